@@ -0,0 +1,389 @@
+# !/usr/bin/env python
+# -*-coding:utf-8 -*-
+
+"""
+# @File     : benchmark.py
+# @Project  : raid6
+# Time      : 18/10/26 2:15 pm
+# Author    : honywen
+# version   : python 3.8
+# Description：Non-interactive throughput and latency benchmarks, reported as JSON
+"""
+
+
+# benchmark.py
+
+import os
+import sys
+import json
+import time
+import socket
+import filecmp
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from raid6 import raid6_stripe, reconstruct_stripe
+from utilities import read_file_to_blocks
+
+DEFAULT_BLOCK_SIZES = '4KB,16KB,64KB,256KB,1MB,4MB'
+DEFAULT_DATA_BYTES = 32 * 1024 * 1024      # data encoded / read per block size
+DEFAULT_E2E_BYTES = 32 * 1024 * 1024       # file stored and recovered per block size
+DEFAULT_REPEAT = 3                         # end-to-end runs per block size
+MIN_PERCENTILE_SAMPLES = 100               # latencies needed before p50/p99 are reported
+DATA_DISKS = 6
+PARITY_DISKS = 2
+BASE_PORT = 5101                           # first port of the benchmark's storage nodes
+NODE_START_TIMEOUT = 10                    # seconds to wait for a spawned node to listen
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage_node', 'storage_node_server.py')
+
+
+def parse_size(size_str):
+    size_str = size_str.strip().upper()
+    for suffix, factor in (('KB', 1024), ('MB', 1024 ** 2), ('GB', 1024 ** 3)):
+        if size_str.endswith(suffix):
+            return int(size_str[:-len(suffix)]) * factor
+    return int(size_str)
+
+
+def peak_rss_kb(pid='self'):
+    """
+    Peak RSS of a process in KB, from VmHWM in /proc/<pid>/status, or None
+    without /proc. Unlike ru_maxrss it starts over when a process execs, so it
+    leaves out memory a child inherited from the process that spawned it.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss(pid):
+    # Writing 5 to clear_refs sets VmHWM back to the current RSS
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def isolated(function, *args):
+    """
+    Run function(*args) in a freshly spawned interpreter, so the peak RSS
+    recorded by its results covers that benchmark alone.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(function, *args).result()
+
+
+def percentile(samples, percent):
+    """
+    The given percentile of samples in ms, or None if there are fewer than
+    MIN_PERCENTILE_SAMPLES of them to take it from.
+    """
+    if len(samples) < MIN_PERCENTILE_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))] * 1000, 4)
+
+
+def result(benchmark, block_size, nbytes, latencies, latency_of, samples=None, **extra):
+    """
+    One JSON record: throughput over the summed latencies, plus the p50/p99
+    of samples, the latencies of each latency_of, which default to latencies.
+    """
+    samples = latencies if samples is None else samples
+    elapsed = sum(latencies)
+    record = {
+        'benchmark': benchmark,
+        'block_size': block_size,
+        'bytes': nbytes,
+        'seconds': round(elapsed, 6),
+        'mb_per_s': round(nbytes / elapsed / 1024 ** 2, 2) if elapsed else None,
+        'latency_of': latency_of,
+        'p50_ms': percentile(samples, 50),
+        'p99_ms': percentile(samples, 99),
+        'samples': len(samples),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+    record.update(extra)
+    print(f"{benchmark:<24} {block_size:>8} B  {record['mb_per_s']:>10} MB/s  "
+          f"p50 {record['p50_ms']} ms  p99 {record['p99_ms']} ms  per {latency_of} ({len(samples)})", file=sys.stderr)
+    return record
+
+
+def random_stripes(block_size, data_bytes):
+    count = max(2, data_bytes // (block_size * DATA_DISKS))
+    stripes = []
+    for _ in range(count):
+        stripe = os.urandom(block_size * DATA_DISKS)
+        stripes.append([stripe[i * block_size:(i + 1) * block_size] for i in range(DATA_DISKS)])
+    return stripes
+
+
+def bench_encode(block_size, data_bytes):
+    # Stripes are encoded again as needed to have enough samples for a p99
+    stripes = random_stripes(block_size, data_bytes)
+    latencies = []
+    for i in range(max(len(stripes), MIN_PERCENTILE_SAMPLES)):
+        started = time.perf_counter()
+        raid6_stripe(stripes[i % len(stripes)])
+        latencies.append(time.perf_counter() - started)
+    return result('raid6_stripe', block_size, len(latencies) * block_size * DATA_DISKS, latencies, 'stripe')
+
+
+def bench_reconstruct(block_size, data_bytes, failures):
+    """
+    Time reconstruct_stripe for every combination of `failures` lost blocks
+    among the data and parity blocks. Each case is checked against the
+    original data.
+    """
+    # Every failure case runs over a quarter of the data to bound the runtime,
+    # repeated as needed to have enough samples for a p99
+    stripes = random_stripes(block_size, data_bytes // 4)
+    parity = [raid6_stripe(stripe) for stripe in stripes]
+    cases = list(combinations(range(DATA_DISKS + PARITY_DISKS), failures))
+    rounds = -(-MIN_PERCENTILE_SAMPLES // (len(cases) * len(stripes)))
+    latencies = []
+    per_case = {}
+    for missing in cases:
+        case_latencies = []
+        for stripe, (p_parity, q_parity) in list(zip(stripes, parity)) * rounds:
+            blocks = list(stripe) + [p_parity, q_parity]
+            blocks = [None if i in missing else block for i, block in enumerate(blocks)]
+            started = time.perf_counter()
+            recovered = reconstruct_stripe(blocks[:DATA_DISKS], blocks[DATA_DISKS], blocks[DATA_DISKS + 1],
+                                           list(missing))
+            case_latencies.append(time.perf_counter() - started)
+            if any(bytes(block) != original for block, original in zip(recovered, stripe)):
+                raise AssertionError(f"reconstruct_stripe returned wrong data for failures {missing}")
+        case_bytes = len(case_latencies) * block_size * DATA_DISKS
+        per_case[','.join(map(str, missing))] = round(case_bytes / sum(case_latencies) / 1024 ** 2, 2)
+        latencies.extend(case_latencies)
+    nbytes = len(latencies) * block_size * DATA_DISKS
+    name = 'reconstruct_single' if failures == 1 else 'reconstruct_double'
+    return result(name, block_size, nbytes, latencies, 'stripe', mb_per_s_by_failure=per_case)
+
+
+def bench_read_file(block_size, path, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        blocks, size = read_file_to_blocks(path, block_size)
+        latencies.append(time.perf_counter() - started)
+        del blocks
+    return result('read_file_to_blocks', block_size, size * repeat, latencies, 'file')
+
+
+def write_random_file(path, size):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            chunk = min(remaining, 4 * 1024 * 1024)
+            f.write(os.urandom(chunk))
+            remaining -= chunk
+
+
+def start_nodes(root, base_port):
+    """
+    Spawn one storage node per disk, each in its own directory under root, and
+    return (processes, cluster config).
+    """
+    nodes, processes = [], []
+    for i in range(DATA_DISKS + PARITY_DISKS):
+        directory = os.path.join(root, f'node{i + 1}')
+        os.makedirs(directory)
+        port = base_port + i
+        processes.append(subprocess.Popen([sys.executable, SERVER_SCRIPT, str(port)], cwd=directory,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        nodes.append({'name': f'node{i + 1}', 'host': 'localhost', 'port': port})
+    deadline = time.monotonic() + NODE_START_TIMEOUT
+    for node in nodes:
+        while True:
+            try:
+                socket.create_connection((node['host'], node['port']), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    stop_nodes(processes)
+                    raise RuntimeError(f"storage node on port {node['port']} did not start")
+                time.sleep(0.05)
+    return processes, {'data_disks': DATA_DISKS, 'nodes': nodes}
+
+
+def stop_nodes(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def _client(config_path, root):
+    """
+    Import main in this benchmark process once the cluster config points at the
+    benchmark's nodes. The client cache is disabled so every recovery goes to
+    the nodes.
+    """
+    os.environ['RAID6_CLUSTER_CONFIG'] = config_path
+    os.chdir(root)
+    import main
+    from cache import BlockCache
+    main.block_cache = BlockCache(0)
+    return main
+
+
+def timed_calls(module, name):
+    """
+    Replace module.name with a wrapper that records the latency of every call
+    in the list returned.
+    """
+    function = getattr(module, name)
+    latencies = []
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    setattr(module, name, timed)
+    return latencies
+
+
+def bench_store(block_size, source, repeat, config_path, root):
+    """
+    Throughput is over whole store_file runs; latencies are those of the
+    batched MSTORE requests to single nodes the runs are made of.
+    """
+    main = _client(config_path, root)
+    import storage_manager
+    requests = timed_calls(storage_manager, 'store_blocks_batch')
+    latencies = []
+    for _ in range(repeat):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            main.store_file(source, block_size)
+            latencies.append(time.perf_counter() - started)
+    return result('store_file', block_size, os.path.getsize(source) * repeat, latencies, 'node request',
+                  requests)
+
+
+def bench_recover(block_size, source, repeat, config_path, root):
+    """
+    Throughput is over whole recover_data runs; latencies are those of the
+    batched MRETRIEVE requests to single nodes the runs are made of.
+    """
+    main = _client(config_path, root)
+    import storage_manager
+    requests = timed_calls(storage_manager, 'retrieve_blocks_batch')
+    name = os.path.basename(source)
+    latencies = []
+    for _ in range(repeat):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            main.recover_data(name)
+            latencies.append(time.perf_counter() - started)
+        if not filecmp.cmp(source, os.path.join(root, f'recovered_{name}'), shallow=False):
+            raise AssertionError(f"recovered file differs from the stored one at block size {block_size}")
+    return result('recover_data', block_size, os.path.getsize(source) * repeat, latencies, 'node request',
+                  requests)
+
+
+def bench_end_to_end(block_sizes, e2e_bytes, repeat, root, base_port):
+    """
+    Store and recover a random file on 8 fresh local storage nodes for every
+    block size. Storing and recovering each run in their own client process;
+    their results also record every node's peak RSS during that benchmark.
+    """
+    os.makedirs(root)
+    source = os.path.join(root, 'e2e.bin')
+    write_random_file(source, e2e_bytes)
+    records = []
+    for block_size in block_sizes:
+        cluster_root = os.path.join(root, str(block_size))
+        processes, cluster = start_nodes(cluster_root, base_port)
+        try:
+            config_path = os.path.join(cluster_root, 'cluster.json')
+            with open(config_path, 'w') as f:
+                json.dump(cluster, f)
+            for bench in (bench_store, bench_recover):
+                record = isolated(bench, block_size, source, repeat, config_path, cluster_root)
+                record['node_peak_rss_kb'] = {node['name']: peak_rss_kb(process.pid)
+                                              for node, process in zip(cluster['nodes'], processes)}
+                for process in processes:
+                    reset_peak_rss(process.pid)
+                records.append(record)
+        finally:
+            stop_nodes(processes)
+    return records
+
+
+def run(block_sizes, data_bytes, e2e_bytes, repeat, end_to_end=True, base_port=BASE_PORT):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='raid6_bench_') as root:
+        read_path = os.path.join(root, 'read.bin')
+        write_random_file(read_path, data_bytes)
+        for block_size in block_sizes:
+            results.append(isolated(bench_encode, block_size, data_bytes))
+            results.append(isolated(bench_reconstruct, block_size, data_bytes, 1))
+            results.append(isolated(bench_reconstruct, block_size, data_bytes, 2))
+            results.append(isolated(bench_read_file, block_size, read_path, repeat))
+        if end_to_end:
+            results.extend(bench_end_to_end(block_sizes, e2e_bytes, repeat, os.path.join(root, 'cluster'), base_port))
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'data_disks': DATA_DISKS,
+            'parity_disks': PARITY_DISKS,
+            'block_sizes': block_sizes,
+            'data_bytes': data_bytes,
+            'e2e_bytes': e2e_bytes,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RAID-6 encode, decode and end-to-end benchmarks')
+    parser.add_argument('--block-sizes', default=DEFAULT_BLOCK_SIZES,
+                        help=f'comma-separated block sizes (default {DEFAULT_BLOCK_SIZES})')
+    parser.add_argument('--data', default=str(DEFAULT_DATA_BYTES),
+                        help='bytes encoded and read per block size, e.g. 64MB')
+    parser.add_argument('--e2e-data', default=str(DEFAULT_E2E_BYTES),
+                        help='size of the file stored and recovered per block size, e.g. 64MB')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs of the file benchmarks per size')
+    parser.add_argument('--no-e2e', action='store_true', help='skip the benchmarks against local storage nodes')
+    parser.add_argument('--base-port', type=int, default=BASE_PORT, help='port of the first local storage node')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = run([parse_size(size) for size in args.block_sizes.split(',')], parse_size(args.data),
+                 parse_size(args.e2e_data), args.repeat, not args.no_e2e, args.base_port)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
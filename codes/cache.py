@@ -0,0 +1,91 @@
+# !/usr/bin/env python
+# -*-coding:utf-8 -*-
+
+"""
+# @File     : cache.py
+# @Project  : raid6
+# Time      : 18/10/26 10:20 am
+# Author    : honywen
+# version   : python 3.8
+# Description：In-process cache of data blocks read from the storage nodes
+"""
+
+
+# cache.py
+
+import threading
+from collections import OrderedDict
+
+
+class BlockCache:
+    """
+    Blocks keyed by (object_id, stripe_index, block_index), kept within a budget
+    of capacity bytes by evicting the least recently used ones. A capacity of 0
+    disables the cache. Safe to use from several threads.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._blocks = OrderedDict()
+        self._keys_by_object = {}
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def __contains__(self, key):
+        # Membership tests don't count as lookups in the hit rate
+        with self._lock:
+            return key in self._blocks
+
+    def put(self, key, block):
+        if len(block) > self.capacity:
+            return
+        with self._lock:
+            self._remove(key)
+            self._blocks[key] = block
+            self._keys_by_object.setdefault(key[0], set()).add(key)
+            self.size += len(block)
+            while self.size > self.capacity:
+                self._remove(next(iter(self._blocks)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        block = self._blocks.pop(key, None)
+        if block is None:
+            return
+        self.size -= len(block)
+        keys = self._keys_by_object[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_object[key[0]]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_object(self, object_id):
+        """
+        Drop every cached block of an object, e.g. after it was stored again.
+        """
+        with self._lock:
+            for key in list(self._keys_by_object.get(object_id, ())):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'blocks': len(self._blocks), 'bytes': self.size, 'capacity': self.capacity}
@@ -0,0 +1,87 @@
+# !/usr/bin/env python
+# -*-coding:utf-8 -*-
+
+"""
+# @File     : framing.py
+# @Project  : raid6
+# Time      : 17/10/26 2:05 pm
+# Author    : honywen
+# version   : python 3.8
+# Description：Buffered framing of node responses on the client side
+"""
+
+
+
+# framing.py
+
+BUFFER_SIZE = 64 * 1024
+
+
+class BufferedReader:
+    """
+    Read newline-terminated headers and fixed-size payloads from a socket.
+
+    Data is received with recv_into() into one preallocated buffer; headers are
+    parsed straight out of it, and payloads are assembled in a single
+    preallocated bytearray, with everything beyond what is already buffered
+    received directly into it.
+    """
+
+    def __init__(self, sock, buffer_size=BUFFER_SIZE):
+        self.sock = sock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def _fill(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            # Move the unread tail to the front to make room
+            pending = self._end - self._start
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        n = self.sock.recv_into(self._view[self._end:])
+        self._end += n
+        return n
+
+    def readline(self):
+        """
+        Return the next line without its terminator, or '' once the peer has
+        closed the connection.
+        """
+        scan_from = self._start
+        while True:
+            index = self._buffer.find(b'\n', scan_from, self._end)
+            if index >= 0:
+                line = bytes(self._view[self._start:index])
+                self._start = index + 1
+                return line.decode('utf-8').strip()
+            if self._start == 0 and self._end == len(self._buffer):
+                raise ValueError('header line exceeds buffer size')
+            scan_from = self._end - self._start
+            if not self._fill():
+                return ''
+            scan_from += self._start
+
+    def readinto(self, view):
+        """
+        Fill the writable buffer `view` completely.
+        """
+        view = memoryview(view).cast('B')
+        size = len(view)
+        buffered = min(size, self._end - self._start)
+        view[:buffered] = self._view[self._start:self._start + buffered]
+        self._start += buffered
+        filled = buffered
+        while filled < size:
+            n = self.sock.recv_into(view[filled:])
+            if not n:
+                raise ConnectionError('connection closed mid-payload')
+            filled += n
+
+    def read_exact(self, size):
+        data = bytearray(size)
+        self.readinto(data)
+        return data
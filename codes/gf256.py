@@ -0,0 +1,140 @@
+# !/usr/bin/env python
+# -*-coding:utf-8 -*-
+
+"""
+# @File     : gf256.py
+# @Project  : raid6
+# Time      : 17/10/26 10:12 am
+# Author    : honywen
+# version   : python 3.8
+# Description：GF(2^8) 查表运算引擎
+"""
+
+
+# gf256.py
+
+import numpy as np
+
+# 与 pyfinite.ffield.FField(8) 相同的本原多项式 x^8 + x^4 + x^3 + x^2 + 1
+PRIMITIVE_POLY = 0x11D
+GENERATOR = 2
+FIELD_SIZE = 256
+FIELD_ORDER = FIELD_SIZE - 1
+
+
+def _build_exp_log_tables():
+    exp_table = [0] * (FIELD_ORDER * 2)
+    log_table = [0] * FIELD_SIZE
+    value = 1
+    for power in range(FIELD_ORDER):
+        exp_table[power] = value
+        log_table[value] = power
+        value <<= 1
+        if value & FIELD_SIZE:
+            value ^= PRIMITIVE_POLY
+    # 复制一份，使 exp[log a + log b] 无需取模
+    for power in range(FIELD_ORDER, FIELD_ORDER * 2):
+        exp_table[power] = exp_table[power - FIELD_ORDER]
+    return exp_table, log_table
+
+
+EXP_TABLE, LOG_TABLE = _build_exp_log_tables()
+
+
+def gf_mul(a, b):
+    """
+    有限域乘法。
+    """
+    if a == 0 or b == 0:
+        return 0
+    return EXP_TABLE[LOG_TABLE[a] + LOG_TABLE[b]]
+
+
+def gf_div(a, b):
+    """
+    有限域除法。
+    """
+    if b == 0:
+        raise ZeroDivisionError("GF(2^8) division by zero")
+    if a == 0:
+        return 0
+    return EXP_TABLE[(LOG_TABLE[a] - LOG_TABLE[b]) % FIELD_ORDER]
+
+
+def gf_inv(a):
+    """
+    有限域乘法逆元。
+    """
+    return gf_div(1, a)
+
+
+def gf_pow(base, exp):
+    """
+    有限域中的幂运算。
+    """
+    if exp == 0:
+        return 1
+    if base == 0:
+        return 0
+    return EXP_TABLE[(LOG_TABLE[base] * exp) % FIELD_ORDER]
+
+
+def _build_mul_table():
+    table = np.zeros((FIELD_SIZE, FIELD_SIZE), dtype=np.uint8)
+    exp_array = np.array(EXP_TABLE, dtype=np.uint8)
+    log_array = np.array(LOG_TABLE, dtype=np.intp)
+    for a in range(1, FIELD_SIZE):
+        table[a, 1:] = exp_array[log_array[1:] + LOG_TABLE[a]]
+    return table
+
+
+# MUL_TABLE[c] 是“乘以常数 c”的 256 字节查找表
+MUL_TABLE = _build_mul_table()
+
+
+def as_array(block):
+    """
+    以零拷贝方式把 bytes / bytearray / memoryview 视为 uint8 数组。
+    """
+    if isinstance(block, np.ndarray):
+        return block
+    return np.frombuffer(block, dtype=np.uint8)
+
+
+def mul_block(coef, block):
+    """
+    整块乘以常数：一次查表完成。
+    """
+    block = as_array(block)
+    if coef == 0:
+        return np.zeros_like(block)
+    if coef == 1:
+        return block.copy()
+    return MUL_TABLE[coef][block]
+
+
+def mul_block_xor(acc, coef, block):
+    """
+    acc ^= coef * block，acc 必须是可写的 uint8 数组。
+    """
+    block = as_array(block)
+    if coef == 0:
+        return acc
+    if coef == 1:
+        np.bitwise_xor(acc, block, out=acc)
+    else:
+        np.bitwise_xor(acc, MUL_TABLE[coef][block], out=acc)
+    return acc
+
+
+def xor_blocks(blocks, block_size=None):
+    """
+    返回所有块逐字节异或的结果。
+    """
+    blocks = [as_array(block) for block in blocks]
+    if block_size is None:
+        block_size = len(blocks[0])
+    acc = np.zeros(block_size, dtype=np.uint8)
+    for block in blocks:
+        np.bitwise_xor(acc, block, out=acc)
+    return acc
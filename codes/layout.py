@@ -0,0 +1,64 @@
+# !/usr/bin/env python
+# -*-coding:utf-8 -*-
+
+"""
+# @File     : layout.py
+# @Project  : raid6
+# Time      : 17/10/26 6:05 pm
+# Author    : honywen
+# version   : python 3.8
+# Description：条带内角色（数据块 / P / Q）到节点的映射
+"""
+
+
+# layout.py
+
+from functools import lru_cache
+
+# 'fixed' 为旧布局：数据块 i 在节点 i，P、Q 固定在最后两个节点
+FIXED = 'fixed'
+LEFT_SYMMETRIC = 'left-symmetric'
+LEFT_ASYMMETRIC = 'left-asymmetric'
+RIGHT_SYMMETRIC = 'right-symmetric'
+RIGHT_ASYMMETRIC = 'right-asymmetric'
+LAYOUTS = (FIXED, LEFT_SYMMETRIC, LEFT_ASYMMETRIC, RIGHT_SYMMETRIC, RIGHT_ASYMMETRIC)
+
+
+@lru_cache(maxsize=None)
+def _layout(layout, rotation, total_disks):
+    k = total_disks - 2
+    if layout == FIXED:
+        return tuple(range(total_disks))
+    if layout in (LEFT_SYMMETRIC, LEFT_ASYMMETRIC):
+        p_node = total_disks - 1 - rotation
+    elif layout in (RIGHT_SYMMETRIC, RIGHT_ASYMMETRIC):
+        p_node = rotation
+    else:
+        raise ValueError(f"未知的校验布局: {layout}")
+    q_node = (p_node + 1) % total_disks
+    if layout in (LEFT_SYMMETRIC, RIGHT_SYMMETRIC):
+        # 对称布局：数据块紧跟在 Q 之后循环排列
+        data_nodes = [(p_node + 2 + i) % total_disks for i in range(k)]
+    else:
+        # 非对称布局：数据块按节点顺序填入，跳过 P、Q
+        data_nodes = [node for node in range(total_disks) if node not in (p_node, q_node)]
+    return tuple(data_nodes) + (p_node, q_node)
+
+
+def stripe_layout(layout, stripe_index, total_disks):
+    """
+    返回条带 stripe_index 中各角色所在的节点下标：
+    前 total_disks - 2 项为数据块 0..k-1，最后两项为 P、Q。
+    轮转布局每 total_disks 个条带循环一次。
+    """
+    return _layout(layout, stripe_index % total_disks, total_disks)
+
+
+def node_roles(layout, stripe_index, total_disks):
+    """
+    stripe_layout 的逆映射：返回各节点在该条带中承担的角色。
+    """
+    roles = [0] * total_disks
+    for role, node in enumerate(stripe_layout(layout, stripe_index, total_disks)):
+        roles[node] = role
+    return roles
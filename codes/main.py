@@ -12,23 +12,79 @@
 
 import os
 import json
-from storage_manager import store_block, retrieve_block, check_node_online
-from utilities import read_file_to_blocks, write_blocks_to_file
-from raid6 import raid6_stripe, reconstruct_stripe
+import time
+import hashlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from storage_manager import (LIST_PAGE_SIZE, NODE_IO_DEPTH, StripeIO, check_node_online, delete_metadata,
+                             get_metadata, list_metadata, put_metadata)
+from utilities import iter_file_stripes, open_output_file, write_stripe_at, close_output_file
+from raid6 import MAX_DATA_DISKS, raid6_stripe, raid6_stripe_batch, rebuild_block, reconstruct_stripe, update_parity
+from layout import FIXED, LEFT_SYMMETRIC, stripe_layout
+from cache import BlockCache
 
-DATA_DISKS = 6
 PARITY_DISKS = 2
+# The cluster geometry (number of data nodes and the node list, P and Q nodes
+# included) comes from this JSON file; without it the 6+2 cluster below is used.
+CLUSTER_CONFIG = os.environ.get('RAID6_CLUSTER_CONFIG',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cluster.json'))
+DEFAULT_CLUSTER = {
+    'data_disks': 6,
+    'nodes': [
+        {'name': 'node1', 'host': 'localhost', 'port': 5001},
+        {'name': 'node2', 'host': 'localhost', 'port': 5002},
+        {'name': 'node3', 'host': 'localhost', 'port': 5003},
+        {'name': 'node4', 'host': 'localhost', 'port': 5004},
+        {'name': 'node5', 'host': 'localhost', 'port': 5005},
+        {'name': 'node6', 'host': 'localhost', 'port': 5006},
+        {'name': 'parity1', 'host': 'localhost', 'port': 5007},
+        {'name': 'parity2', 'host': 'localhost', 'port': 5008},
+    ],
+}
+
+
+def load_cluster_config(path=CLUSTER_CONFIG):
+    if not os.path.exists(path):
+        return DEFAULT_CLUSTER
+    with open(path) as f:
+        config = json.load(f)
+    data_disks, nodes = config['data_disks'], config['nodes']
+    if not 1 <= data_disks <= MAX_DATA_DISKS:
+        raise ValueError(f"data_disks must be between 1 and {MAX_DATA_DISKS}, got {data_disks}")
+    if len(nodes) != data_disks + PARITY_DISKS:
+        raise ValueError(f"Expected {data_disks + PARITY_DISKS} nodes for {data_disks} data disks, got {len(nodes)}")
+    if len({node['name'] for node in nodes}) != len(nodes):
+        raise ValueError("Node names must be unique")
+    return config
+
+
+CLUSTER = load_cluster_config()
+DATA_DISKS = CLUSTER['data_disks']
 TOTAL_DISKS = DATA_DISKS + PARITY_DISKS
-STORAGE_NODES = [
-    {'name': 'node1', 'host': 'localhost', 'port': 5001},
-    {'name': 'node2', 'host': 'localhost', 'port': 5002},
-    {'name': 'node3', 'host': 'localhost', 'port': 5003},
-    {'name': 'node4', 'host': 'localhost', 'port': 5004},
-    {'name': 'node5', 'host': 'localhost', 'port': 5005},
-    {'name': 'node6', 'host': 'localhost', 'port': 5006},
-    {'name': 'parity1', 'host': 'localhost', 'port': 5007},
-    {'name': 'parity2', 'host': 'localhost', 'port': 5008},
-]
+STORAGE_NODES = CLUSTER['nodes']
+# Stripe encoder pipeline: worker processes, stripes per task, and the bytes of
+# stripe data read and encoded ahead of the upload stage, whatever the block size.
+ENCODE_WORKERS = os.cpu_count() or 1
+ENCODE_BATCH_STRIPES = 4
+ENCODE_INFLIGHT_BYTES = 256 * 1024 * 1024
+# Requests per node whose block uploads or downloads overlap on the storage nodes.
+IO_DEPTH = NODE_IO_DEPTH
+# Payload each node moves per MSTORE/MRETRIEVE; small blocks from consecutive
+# stripes share one request so per-request overhead doesn't swamp the data.
+IO_BATCH_BYTES = 1024 * 1024
+# Placement of data, P and Q blocks on the nodes for new objects (see layout.py).
+# Rotating layouts spread parity writes and data reads over all nodes.
+PARITY_LAYOUT = LEFT_SYMMETRIC
+# Data blocks read by recover_data and read_range are kept in memory up to this
+# many bytes (0 disables the cache); a read_range that continues where the
+# previous one on the object ended also fetches this many following stripes.
+BLOCK_CACHE_BYTES = 256 * 1024 * 1024
+READ_AHEAD_STRIPES = 2
+MAX_TRACKED_READERS = 1024
+
+block_cache = BlockCache(BLOCK_CACHE_BYTES)
+# Where the last read_range of each object ended, to spot sequential readers
+_read_positions = {}
 
 
 def parse_block_size(size_str):
@@ -41,56 +97,436 @@ def parse_block_size(size_str):
         raise ValueError("Invalid block size format. Use KB or MB (e.g., 64KB, 1MB)")
 
 
-def store_raid6(blocks, original_size, original_filename, block_size):
-    metadata = {
+def object_id_for(object_name):
+    """
+    Short stable id that prefixes every block key of an object.
+    """
+    return hashlib.sha1(object_name.encode('utf-8')).hexdigest()[:16]
+
+
+def block_key(object_id, stripe_index, block_index):
+    return f'{object_id}_stripe_{stripe_index}_block_{block_index}'
+
+
+def parse_block_key(name):
+    """
+    Return (object_id, stripe_index, block_index) of a key made by block_key,
+    or None if name is not one.
+    """
+    parts = name.split('_')
+    if len(parts) != 5 or parts[1:4:2] != ['stripe', 'block'] or not (parts[2].isdigit() and parts[4].isdigit()):
+        return None
+    return parts[0], int(parts[2]), int(parts[4])
+
+
+def new_metadata(object_name, original_filename, original_size, total_stripes, block_size, layout):
+    return {
+        'object_name': object_name,
+        'object_id': object_id_for(object_name),
         'original_filename': original_filename,
         'original_size': original_size,
-        'total_stripes': len(blocks) // DATA_DISKS + (1 if len(blocks) % DATA_DISKS else 0),
-        'block_size': block_size
+        'total_stripes': total_stripes,
+        'block_size': block_size,
+        'layout': layout,
+        'data_disks': DATA_DISKS,
+        'nodes': [node['name'] for node in STORAGE_NODES]
     }
 
-    print(f"Storing metadata: {metadata}")
-    metadata_json = json.dumps(metadata)
-    for node in STORAGE_NODES:
-        store_block(node, 'metadata', metadata_json.encode())
 
-    for stripe_index, stripe_blocks in enumerate(chunks(blocks, DATA_DISKS)):
-        print(f"Processing stripe {stripe_index}")
-        while len(stripe_blocks) < DATA_DISKS:
-            stripe_blocks.append(b'\x00' * block_size)
+def object_layout(metadata):
+    # Objects stored before parity rotation keep P and Q on the last two nodes
+    return metadata.get('layout', FIXED)
+
+
+def object_geometry(metadata):
+    """
+    Return (data_disks, nodes) an object was stored with, nodes in the order its
+    layout refers to them. Nodes are matched by name against the current
+    cluster config, so their addresses may change; a node that is no longer
+    configured has no address. Objects stored before the geometry was recorded
+    use the default 6+2 cluster.
+    """
+    data_disks = metadata.get('data_disks', DEFAULT_CLUSTER['data_disks'])
+    names = metadata.get('nodes', [node['name'] for node in DEFAULT_CLUSTER['nodes']])
+    configured = {node['name']: node for node in STORAGE_NODES}
+    return data_disks, [configured.get(name, {'name': name}) for name in names]
 
-        p_parity, q_parity = raid6_stripe(stripe_blocks)
 
-        for i, block in enumerate(stripe_blocks + [p_parity, q_parity]):
-            filename = f'stripe_{stripe_index}_block_{i}'
-            store_block(STORAGE_NODES[i], filename, block)
+def online_flags(nodes):
+    return ['host' in node and check_node_online(node) for node in nodes]
 
-        print(f"Stored stripe {stripe_index}")
+
+def store_raid6(blocks, original_size, original_filename, block_size,
+                workers=ENCODE_WORKERS, max_inflight=None, io_depth=IO_DEPTH, object_name=None,
+                layout=PARITY_LAYOUT):
+    total_stripes = len(blocks) // DATA_DISKS + (1 if len(blocks) % DATA_DISKS else 0)
+    metadata = new_metadata(object_name or original_filename, original_filename, original_size,
+                            total_stripes, block_size, layout)
+    stripes = (pad_stripe(stripe_blocks, block_size) for stripe_blocks in chunks(blocks, DATA_DISKS))
+    store_stripes(stripes, metadata, workers, max_inflight, io_depth)
+
+
+def store_file(file_path, block_size, workers=ENCODE_WORKERS, max_inflight=None,
+               io_depth=IO_DEPTH, object_name=None, layout=PARITY_LAYOUT):
+    """
+    Streaming variant of store_raid6: stripes are read from disk as they are encoded,
+    so memory use depends on the in-flight bound, not on the file size.
+    The object is named after the file unless object_name is given.
+    """
+    original_filename = os.path.basename(file_path)
+    original_size = os.path.getsize(file_path)
+    stripe_size = block_size * DATA_DISKS
+    total_stripes = original_size // stripe_size + (1 if original_size % stripe_size else 0)
+    metadata = new_metadata(object_name or original_filename, original_filename, original_size,
+                            total_stripes, block_size, layout)
+    # Unencoded stripes reuse the reader's buffers, so keep enough of them for
+    # every stripe that may still be uploading.
+    depth = io_depth * stripes_per_request(block_size) + 1
+    stripes = iter_file_stripes(file_path, block_size, DATA_DISKS, depth=depth)
+    store_stripes(stripes, metadata, workers, max_inflight, io_depth)
+
+
+def store_stripes(stripes, metadata, workers=ENCODE_WORKERS, max_inflight=None,
+                  io_depth=IO_DEPTH):
+    """
+    Encode and upload stripes. Every node receives its blocks of a group of
+    stripes in one MSTORE request; the nodes are written concurrently and up to
+    io_depth groups are uploading at once. At most max_inflight stripes, by
+    default as many as fit in ENCODE_INFLIGHT_BYTES, are in the encoder. The
+    object's metadata is published on every node once all of its blocks are
+    stored. If the object is being stored again, the blocks of its previous
+    version that won't be overwritten are deleted first.
+    """
+    object_id = metadata['object_id']
+    layout = object_layout(metadata)
+    data_disks, nodes = object_geometry(metadata)
+    previous = lookup_object(metadata['object_name'], [node for node in nodes if 'host' in node and
+                                                        check_node_online(node)], missing_ok=True)
+    if previous is not None:
+        delete_object_blocks(previous, keep=metadata)
+    if max_inflight is None:
+        max_inflight = max(1, ENCODE_INFLIGHT_BYTES // (metadata['block_size'] * data_disks))
+    with StripeIO(nodes, io_depth) as stripe_io:
+        uploading = deque()
+        encoded = encode_stripes(stripes, max_inflight, workers)
+        for group in chunks(encoded, stripes_per_request(metadata['block_size'])):
+            items = [[] for _ in nodes]
+            for stripe_index, stripe_blocks, p_parity, q_parity in group:
+                placement = stripe_layout(layout, stripe_index, len(nodes))
+                for role, block in enumerate(list(stripe_blocks) + [p_parity, q_parity]):
+                    items[placement[role]].append((block_key(object_id, stripe_index, role), block))
+            uploading.append((group[0][0], group[-1][0], stripe_io.submit_store_batch(items)))
+            while len(uploading) >= io_depth:
+                _finish_upload(*uploading.popleft())
+        while uploading:
+            _finish_upload(*uploading.popleft())
+
+        print(f"Storing metadata: {metadata}")
+        metadata_json = json.dumps(metadata).encode()
+        for future in stripe_io.submit_each(put_metadata, metadata['object_name'], metadata_json):
+            future.result()
+    block_cache.invalidate_object(object_id)
 
     print(f"Total stripes stored: {metadata['total_stripes']}")
 
 
-def recover_data():
-    online_nodes = [node for node in STORAGE_NODES if check_node_online(node)]
-    print(f"Online nodes: {[node['name'] for node in online_nodes]}")
-    if len(online_nodes) < DATA_DISKS:
-        print(f"Error: Not enough online nodes to recover data. Online nodes: {len(online_nodes)}")
+def _finish_upload(first_index, last_index, futures):
+    for future in futures:
+        future.result()
+    print(f"Stored stripes {first_index}-{last_index}")
+
+
+def delete_object_blocks(metadata, keep=None):
+    """
+    Delete the blocks of the object metadata describes, except those that
+    storing it as keep describes overwrites: blocks of the stripes both have
+    that stay on the same node. Returns whether all the others are gone.
+    """
+    object_id = metadata['object_id']
+    layout = object_layout(metadata)
+    _, nodes = object_geometry(metadata)
+    if keep is not None:
+        _, keep_nodes = object_geometry(keep)
+    stale = [[] for _ in nodes]
+    for stripe_index in range(metadata['total_stripes']):
+        kept = []
+        if keep is not None and stripe_index < keep['total_stripes']:
+            kept = [keep_nodes[node]['name']
+                    for node in stripe_layout(object_layout(keep), stripe_index, len(keep_nodes))]
+        for role, node in enumerate(stripe_layout(layout, stripe_index, len(nodes))):
+            if role >= len(kept) or kept[role] != nodes[node]['name']:
+                stale[node].append(block_key(object_id, stripe_index, role))
+    block_cache.invalidate_object(object_id)
+    if not any(stale):
+        return True
+    print(f"Deleting {sum(map(len, stale))} blocks of '{metadata['object_name']}'")
+    unconfigured = [node['name'] for node, names in zip(nodes, stale) if names and 'host' not in node]
+    if unconfigured:
+        print(f"Error: Nodes {unconfigured} are no longer configured, their blocks are left behind")
+    with StripeIO(nodes) as stripe_io:
+        futures = stripe_io.submit_delete_batch([names if names and 'host' in node else None
+                                                 for node, names in zip(nodes, stale)])
+        deleted = all(future.result() for future in futures if future is not None)
+    return deleted and not unconfigured
+
+
+def stripes_per_request(block_size):
+    return max(1, IO_BATCH_BYTES // block_size)
+
+
+def read_roles(layout, nodes_online, data_disks, stripe_index):
+    """
+    Roles worth reading for a stripe: only its data blocks, unless one of them
+    sits on an offline node and P and Q are needed to rebuild it.
+    """
+    placement = stripe_layout(layout, stripe_index, len(nodes_online))
+    if all(nodes_online[placement[role]] for role in range(data_disks)):
+        return range(data_disks)
+    return range(len(nodes_online))
+
+
+def _submit_fetch(stripe_io, layout, nodes_online, object_id, wanted):
+    """
+    Send every online node one batched request for the blocks of
+    {stripe_index: roles} it holds under layout.
+    """
+    requested = [[] for _ in nodes_online]
+    for stripe_index, roles in sorted(wanted.items()):
+        placement = stripe_layout(layout, stripe_index, len(nodes_online))
+        for role in roles:
+            if nodes_online[placement[role]]:
+                requested[placement[role]].append((stripe_index, role))
+    futures = stripe_io.submit_retrieve_batch(
+        [[block_key(object_id, stripe_index, role) for stripe_index, role in entries] or None
+         for entries in requested])
+    return requested, futures
+
+
+def _collect_fetch(requested, futures):
+    blocks = {}
+    for entries, future in zip(requested, futures):
+        if future is not None:
+            blocks.update(zip(entries, future.result()))
+    return blocks
+
+
+def _collect_hedged(stripe_io, layout, nodes_online, object_id, requested, futures, started):
+    """
+    Like _collect_fetch, but if up to two nodes haven't answered once the
+    hedge deadline has passed since `started`, their stripes are also read
+    from the other nodes and the blocks they hold rebuilt from parity. Whichever
+    finishes first is used; the other requests are cancelled if they haven't
+    started yet and otherwise left to finish unused. A slow node whose request
+    is still running when its hedge wins is marked offline in nodes_online, so
+    the rest of the read stops sending it requests that would queue behind the
+    abandoned one and tie up I/O threads until it times out.
+    """
+    deadline = stripe_io.hedge_deadline(max(len(entries) for entries in requested))
+    if deadline is None:
+        return _collect_fetch(requested, futures)
+    wait([future for future in futures if future is not None], max(0, started + deadline - time.monotonic()))
+    slow = [node for node, future in enumerate(futures) if future is not None and not future.done()]
+    if not slow or len(slow) > 2:
+        return _collect_fetch(requested, futures)
+
+    total_disks = len(nodes_online)
+    lagging = {}
+    for node in slow:
+        for stripe_index, role in requested[node]:
+            lagging.setdefault(stripe_index, []).append(role)
+    received = {stripe_index: set() for stripe_index in lagging}
+    for node, entries in enumerate(requested):
+        for stripe_index, role in entries:
+            if node not in slow and stripe_index in lagging:
+                received[stripe_index].add(role)
+    hedge_online = [online and node not in slow for node, online in enumerate(nodes_online)]
+    # Read just enough other blocks to have k per stripe, data blocks first
+    extra = {}
+    for stripe_index, roles in received.items():
+        placement = stripe_layout(layout, stripe_index, total_disks)
+        candidates = [role for role in range(total_disks)
+                      if role not in roles and hedge_online[placement[role]]]
+        extra[stripe_index] = candidates[:total_disks - 2 - len(roles)]
+    print(f"Hedging {len(lagging)} stripes held up by {[stripe_io.nodes[node]['name'] for node in slow]}")
+    hedge_requested, hedge_futures = _submit_fetch(stripe_io, layout, hedge_online, object_id, extra)
+
+    slow_futures = [futures[node] for node in slow]
+    pending_hedge = [future for future in hedge_futures if future is not None]
+    while not all(future.done() for future in pending_hedge):
+        if all(future.done() for future in slow_futures):
+            for future in pending_hedge:
+                future.cancel()
+            return _collect_fetch(requested, futures)
+        wait([future for future in slow_futures + pending_hedge if not future.done()], return_when=FIRST_COMPLETED)
+
+    blocks = _collect_fetch(requested, [None if node in slow else future for node, future in enumerate(futures)])
+    blocks.update(_collect_fetch(hedge_requested, hedge_futures))
+    try:
+        for stripe_index, roles in lagging.items():
+            stripe_blocks = [blocks.get((stripe_index, role)) for role in range(total_disks)]
+            for role in roles:
+                blocks[(stripe_index, role)] = rebuild_block(stripe_blocks, role)
+    except ValueError:
+        # Too few blocks came back to rebuild from, so wait for the slow nodes after all
+        return _collect_fetch(requested, futures)
+    for node in slow:
+        if not futures[node].cancel() and not futures[node].done():
+            nodes_online[node] = False
+    return blocks
+
+
+def fetch_stripes(stripe_io, layout, nodes_online, object_id, total_stripes, batch_stripes, io_depth=IO_DEPTH,
+                  roles_for=None, first_stripe=0, hedge=True):
+    """
+    Yield (stripe_index, blocks) in stripe order from first_stripe on, with
+    blocks indexed by role. blocks[role] is None if its node is offline, failed
+    to return the block, or the role is not in roles_for(stripe_index) (all
+    roles by default). Each online node is asked for batch_stripes stripes per
+    MRETRIEVE, and up to io_depth of those requests per node are in flight
+    ahead of the caller. Blocks of a node slower than the hedge deadline may be
+    rebuilt from parity instead, unless hedge is False; a node left behind that
+    way is marked offline in nodes_online from then on, so roles_for should
+    consult the same list.
+    """
+    def submit(first_index):
+        indices = range(first_index, min(first_index + batch_stripes, total_stripes))
+        wanted = {stripe_index: roles_for(stripe_index) if roles_for else range(len(nodes_online))
+                  for stripe_index in indices}
+        return indices, _submit_fetch(stripe_io, layout, nodes_online, object_id, wanted), time.monotonic()
+
+    fetching = deque()
+    next_fetch = first_stripe
+    while next_fetch < total_stripes or fetching:
+        while next_fetch < total_stripes and len(fetching) < io_depth:
+            fetching.append(submit(next_fetch))
+            next_fetch += batch_stripes
+        indices, pending, started = fetching.popleft()
+        if hedge:
+            blocks = _collect_hedged(stripe_io, layout, nodes_online, object_id, *pending, started)
+        else:
+            blocks = _collect_fetch(*pending)
+        for stripe_index in indices:
+            yield stripe_index, [blocks.get((stripe_index, role)) for role in range(len(nodes_online))]
+
+
+def pad_stripe(stripe_blocks, block_size):
+    stripe_blocks = list(stripe_blocks)
+    while len(stripe_blocks) < DATA_DISKS:
+        stripe_blocks.append(b'\x00' * block_size)
+    return stripe_blocks
+
+
+def encode_stripes(stripes, max_inflight, workers=ENCODE_WORKERS, batch_size=ENCODE_BATCH_STRIPES):
+    """
+    Yield (stripe_index, stripe_blocks, p_parity, q_parity) in stripe order.
+
+    With more than one worker, batches of stripes are encoded in a process pool
+    while the caller uploads the stripes that are already done. At most
+    max_inflight stripes are submitted but not yet handed back to the caller;
+    batches shrink when that bound is too tight to give every worker a batch.
+    """
+    if workers <= 1:
+        for stripe_index, stripe_blocks in enumerate(stripes):
+            print(f"Processing stripe {stripe_index}")
+            p_parity, q_parity = raid6_stripe(stripe_blocks)
+            yield stripe_index, stripe_blocks, p_parity, q_parity
         return
 
-    metadata = None
-    for node in online_nodes:
-        try:
-            metadata_json = retrieve_block(node, 'metadata')
-            if metadata_json:
-                metadata = json.loads(metadata_json.decode())
-                print(f"Retrieved metadata from node {node['name']}")
-                break
-        except Exception as e:
-            print(f"Failed to retrieve metadata from node {node['name']}: {str(e)}")
+    batch_size = max(1, min(batch_size, max_inflight // workers))
+    max_batches = max(1, max_inflight // batch_size)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        inflight = deque()
+        stripe_index = 0
+        # Streamed stripes are views into reused read buffers: copy each one out
+        # as it is read, before it is batched and queued for the worker processes.
+        stripes = ([bytes(block) if isinstance(block, memoryview) else block for block in stripe_blocks]
+                   for stripe_blocks in stripes)
+        for batch in chunks(stripes, batch_size):
+            print(f"Processing stripes {stripe_index}-{stripe_index + len(batch) - 1}")
+            inflight.append((stripe_index, batch, pool.submit(raid6_stripe_batch, batch)))
+            stripe_index += len(batch)
+            while len(inflight) >= max_batches:
+                yield from _drain_batch(inflight.popleft())
+        while inflight:
+            yield from _drain_batch(inflight.popleft())
+
+
+def _drain_batch(entry):
+    first_index, batch, future = entry
+    for offset, (stripe_blocks, (p_parity, q_parity)) in enumerate(zip(batch, future.result())):
+        yield first_index + offset, stripe_blocks, p_parity, q_parity
+
+
+def lookup_object(object_name, nodes=None, missing_ok=False):
+    """
+    Return the metadata of object_name from the first node that has it, or
+    None; with missing_ok, nodes that don't know the object aren't reported.
+    """
+    for node in nodes if nodes is not None else STORAGE_NODES:
+        metadata_json = get_metadata(node, object_name, missing_ok)
+        if metadata_json:
+            print(f"Retrieved metadata from node {node['name']}")
+            return json.loads(metadata_json.decode())
+    return None
+
+
+def stat_object(object_name):
+    return lookup_object(object_name, [node for node in STORAGE_NODES if check_node_online(node)])
+
+
+def list_objects():
+    """
+    Yield the names of all stored objects, a page at a time, ordered by their
+    percent-encoded form as the nodes keep them ('[' comes before 'Z'). If a
+    node fails mid-listing, the next online node carries on after the last
+    name yielded.
+    """
+    start_after = ''
+    for node in STORAGE_NODES:
+        if not check_node_online(node):
             continue
+        while True:
+            names = list_metadata(node, start_after, LIST_PAGE_SIZE)
+            if names is None:
+                break
+            yield from names
+            if len(names) < LIST_PAGE_SIZE:
+                return
+            start_after = names[-1]
+    print("Error: Could not list the objects on any node")
+
+
+def delete_object(object_name):
+    """
+    Delete every block of object_name, then its metadata on every node. The
+    metadata stays until no block is left behind, so a delete that fails can
+    be run again. Returns True on success.
+    """
+    metadata = stat_object(object_name)
+    if not metadata:
+        print(f"Error: Could not retrieve metadata of '{object_name}' from any node")
+        return False
+    if not delete_object_blocks(metadata):
+        print(f"Error: Not every block of '{object_name}' could be deleted, its metadata is kept")
+        return False
+    _, nodes = object_geometry(metadata)
+    with StripeIO([node for node in nodes if 'host' in node]) as stripe_io:
+        removed = [future.result() for future in stripe_io.submit_each(delete_metadata, object_name)]
+    _read_positions.pop(metadata['object_id'], None)
+    if not all(removed):
+        print(f"Error: The metadata of '{object_name}' could not be removed from every node")
+        return False
+    print(f"Deleted '{object_name}'")
+    return True
 
+
+def recover_data(object_name, io_depth=IO_DEPTH):
+    online_nodes = [node for node in STORAGE_NODES if check_node_online(node)]
+    print(f"Online nodes: {[node['name'] for node in online_nodes]}")
+
+    metadata = lookup_object(object_name, online_nodes)
     if not metadata:
-        print("Error: Could not retrieve metadata from any node")
+        print(f"Error: Could not retrieve metadata of '{object_name}' from any node")
         return
 
     print(f"Metadata: {metadata}")
@@ -98,51 +534,298 @@ def recover_data():
     original_size = metadata['original_size']
     original_filename = metadata['original_filename']
     block_size = metadata['block_size']
+    layout = object_layout(metadata)
+    data_disks, nodes = object_geometry(metadata)
+    total_disks = len(nodes)
+    nodes_online = online_flags(nodes)
+    if sum(nodes_online) < data_disks:
+        print(f"Error: Not enough online nodes to recover data. Online nodes: {sum(nodes_online)}")
+        return
+
+    output_file = f'recovered_{original_filename}'
+    fd = open_output_file(output_file, original_size)
+    offset = 0
+    object_id = metadata['object_id']
+    stripe_io = StripeIO(nodes, io_depth, block_size)
+    try:
+        # Stripes whose data nodes are all up are read without P and Q, which
+        # are fetched per stripe only if a data block fails after all. Cached
+        # blocks are taken out of the cache when their stripe is requested.
+        cached = {}
 
-    reconstructed_blocks = []
+        def roles_for(stripe_index):
+            return read_roles(layout, nodes_online, data_disks, stripe_index)
 
-    for stripe_index in range(total_stripes):
-        print(f"Processing stripe {stripe_index}")
-        stripe_blocks = []
-        missing_indices = []
-        for i, node in enumerate(STORAGE_NODES):
-            if node in online_nodes:
-                block = retrieve_block(node, f'stripe_{stripe_index}_block_{i}')
+        def uncached_roles(stripe_index):
+            roles = []
+            for role in roles_for(stripe_index):
+                block = block_cache.get((object_id, stripe_index, role)) if role < data_disks else None
                 if block is None:
-                    print(f"Failed to retrieve block from online node {node['name']}")
-                    missing_indices.append(i)
+                    roles.append(role)
+                else:
+                    cached[(stripe_index, role)] = block
+            return roles
+
+        fetched = fetch_stripes(stripe_io, layout, nodes_online, object_id, total_stripes,
+                                stripes_per_request(block_size), io_depth, uncached_roles)
+        for stripe_index, blocks in fetched:
+            print(f"Processing stripe {stripe_index}")
+            for role in range(data_disks):
+                if blocks[role] is None:
+                    blocks[role] = cached.pop((stripe_index, role), None)
                 else:
+                    block_cache.put((object_id, stripe_index, role), blocks[role])
+            data_blocks = blocks[:data_disks]
+            if all(block is not None for block in data_blocks):
+                # Healthy stripe: the received blocks go straight to the file
+                offset = write_stripe_at(fd, data_blocks, offset)
+                continue
+
+            fetched_roles = roles_for(stripe_index)
+            unfetched = {stripe_index: [role for role in range(total_disks) if role not in fetched_roles]}
+            if unfetched[stripe_index]:
+                parity = fetch_blocks(stripe_io, layout, nodes_online, object_id, unfetched)
+                for (_, role), block in parity.items():
+                    blocks[role] = block
+
+            stripe_blocks = []
+            missing_indices = []
+            placement = stripe_layout(layout, stripe_index, total_disks)
+            for i, block in enumerate(blocks):
+                node = nodes[placement[i]]
+                # A block from the cache is good even if its node is offline
+                if block is not None:
                     stripe_blocks.append(block)
-            else:
-                print(f"Node {node['name']} is offline")
+                    continue
+                if nodes_online[placement[i]]:
+                    print(f"Failed to retrieve block from online node {node['name']}")
+                else:
+                    print(f"Node {node['name']} is offline")
                 missing_indices.append(i)
                 stripe_blocks.append(None)
 
-        print(f"Missing indices for stripe {stripe_index}: {missing_indices}")
+            print(f"Missing indices for stripe {stripe_index}: {missing_indices}")
+
+            try:
+                reconstructed_stripe = reconstruct_stripe(stripe_blocks[:data_disks], stripe_blocks[data_disks],
+                                                          stripe_blocks[data_disks + 1], missing_indices)
+                print(f"Successfully reconstructed stripe {stripe_index}")
+            except Exception as e:
+                print(f"Error reconstructing stripe {stripe_index}: {str(e)}")
+                return
+
+            for role in missing_indices:
+                if role < data_disks:
+                    block_cache.put((object_id, stripe_index, role), reconstructed_stripe[role])
+            # Stream each stripe to disk as soon as it is available
+            offset = write_stripe_at(fd, reconstructed_stripe[:data_disks], offset)
+    finally:
+        stripe_io.close()
+        close_output_file(fd, min(offset, original_size))
+
+    print(f"Recovered file saved as '{output_file}'")
+    print(f"Original size: {original_size}, Recovered size: {os.path.getsize(output_file)}")
+
 
+def fetch_blocks(stripe_io, layout, nodes_online, object_id, wanted):
+    """
+    Fetch {stripe_index: roles} with one batched request per node.
+    Returns {(stripe_index, role): data}, with None for blocks that live on an
+    offline node or could not be retrieved.
+    """
+    blocks = {(stripe_index, role): None for stripe_index, roles in wanted.items() for role in roles}
+    started = time.monotonic()
+    pending = _submit_fetch(stripe_io, layout, nodes_online, object_id, wanted)
+    blocks.update(_collect_hedged(stripe_io, layout, nodes_online, object_id, *pending, started))
+    return blocks
+
+
+def read_range(object_name, offset, length, io_depth=IO_DEPTH):
+    """
+    Return up to `length` bytes of object_name starting at `offset`.
+
+    Only the data blocks overlapping the range that aren't in the block cache
+    are fetched. P, Q and the other blocks of a stripe are pulled only for
+    stripes where one of those data blocks can't be read, and the missing
+    block is reconstructed from them. A read that starts where the previous
+    one on the object ended also fetches the data blocks of the next
+    READ_AHEAD_STRIPES stripes into the cache.
+    """
+    metadata = stat_object(object_name)
+    if not metadata:
+        print(f"Error: Could not retrieve metadata of '{object_name}' from any node")
+        return None
+    end = min(offset + length, metadata['original_size'])
+    if offset >= end:
+        return b''
+
+    object_id = metadata['object_id']
+    block_size = metadata['block_size']
+    data_disks, nodes = object_geometry(metadata)
+    total_disks = len(nodes)
+    first_block, last_block = offset // block_size, (end - 1) // block_size
+    blocks = {}
+    wanted = {}
+    for block_number in range(first_block, last_block + 1):
+        stripe_index, i = divmod(block_number, data_disks)
+        block = block_cache.get((object_id, stripe_index, i))
+        if block is None:
+            wanted.setdefault(stripe_index, []).append(i)
+        else:
+            blocks[(stripe_index, i)] = block
+    ahead = _read_ahead(object_id, offset, end, last_block // data_disks, data_disks, metadata['total_stripes'])
+    if not wanted and not ahead:
+        return _copy_range(blocks, offset, end, block_size, data_disks)
+
+    layout = object_layout(metadata)
+    nodes_online = online_flags(nodes)
+    with StripeIO(nodes, io_depth, block_size) as stripe_io:
+        fetched = fetch_blocks(stripe_io, layout, nodes_online, object_id, {**wanted, **ahead})
+        # Hedged reads may also return P, Q and other blocks; only data is cached
+        for (stripe_index, i), block in fetched.items():
+            if block is not None and i < data_disks:
+                block_cache.put((object_id, stripe_index, i), block)
+        blocks.update(fetched)
+        degraded = sorted({stripe_index for stripe_index, roles in wanted.items()
+                           if any(blocks[(stripe_index, i)] is None for i in roles)})
+        if degraded:
+            print(f"Reconstructing stripes {degraded} from parity")
+            peers = {stripe_index: [i for i in range(total_disks) if (stripe_index, i) not in blocks]
+                     for stripe_index in degraded}
+            blocks.update(fetch_blocks(stripe_io, layout, nodes_online, object_id, peers))
+
+    for stripe_index in degraded:
+        stripe_blocks = [blocks[(stripe_index, i)] for i in range(total_disks)]
+        missing_indices = [i for i, block in enumerate(stripe_blocks) if block is None]
         try:
-            reconstructed_stripe = reconstruct_stripe(stripe_blocks[:DATA_DISKS], stripe_blocks[DATA_DISKS],
-                                                      stripe_blocks[DATA_DISKS + 1], missing_indices)
-            reconstructed_blocks.extend(reconstructed_stripe[:DATA_DISKS])
-            print(f"Successfully reconstructed stripe {stripe_index}")
+            reconstructed = reconstruct_stripe(stripe_blocks[:data_disks], stripe_blocks[data_disks],
+                                               stripe_blocks[data_disks + 1], missing_indices)
         except Exception as e:
             print(f"Error reconstructing stripe {stripe_index}: {str(e)}")
-            return
+            return None
+        for i in wanted[stripe_index]:
+            blocks[(stripe_index, i)] = reconstructed[i]
+            block_cache.put((object_id, stripe_index, i), reconstructed[i])
 
-    output_file = f'recovered_{original_filename}'
-    write_blocks_to_file(reconstructed_blocks, output_file, original_size)
-    print(f"Recovered file saved as '{output_file}'")
-    print(f"Original size: {original_size}, Recovered size: {os.path.getsize(output_file)}")
+    return _copy_range(blocks, offset, end, block_size, data_disks)
+
+
+def _read_ahead(object_id, offset, end, last_stripe, data_disks, total_stripes):
+    """
+    Note where this read of the object ends and, if it picks up where the last
+    one ended, return {stripe_index: roles} of the uncached data blocks of the
+    READ_AHEAD_STRIPES stripes after last_stripe.
+    """
+    sequential = _read_positions.pop(object_id, None) == offset
+    _read_positions[object_id] = end
+    if len(_read_positions) > MAX_TRACKED_READERS:
+        del _read_positions[next(iter(_read_positions))]
+    if not sequential or not block_cache.capacity:
+        return {}
+    ahead = {}
+    for stripe_index in range(last_stripe + 1, min(last_stripe + 1 + READ_AHEAD_STRIPES, total_stripes)):
+        roles = [i for i in range(data_disks) if (object_id, stripe_index, i) not in block_cache]
+        if roles:
+            ahead[stripe_index] = roles
+    return ahead
 
 
-def chunks(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
+def _copy_range(blocks, offset, end, block_size, data_disks):
+    data = bytearray(end - offset)
+    for block_number in range(offset // block_size, (end - 1) // block_size + 1):
+        block = blocks[divmod(block_number, data_disks)]
+        block_start = block_number * block_size
+        start, stop = max(offset, block_start), min(end, block_start + block_size)
+        data[start - offset:stop - offset] = memoryview(block)[start - block_start:stop - block_start]
+    return data
+
+
+def update_block(object_name, stripe_index, block_index, new_data, io_depth=IO_DEPTH):
+    """
+    Overwrite data block block_index of stripe stripe_index of object_name with
+    new_data in place. Returns True on success.
+
+    Only the old block, P and Q are read and only those three blocks are
+    written: the new parity follows from the old and new data alone. If one of
+    them can't be read, the rest of the stripe is fetched and the parity is
+    recomputed from the reconstructed stripe instead. The nodes holding the
+    three blocks must be online.
+    """
+    metadata = stat_object(object_name)
+    if not metadata:
+        print(f"Error: Could not retrieve metadata of '{object_name}' from any node")
+        return False
+    block_size = metadata['block_size']
+    data_disks, nodes = object_geometry(metadata)
+    if not 0 <= stripe_index < metadata['total_stripes'] or not 0 <= block_index < data_disks:
+        print(f"Error: '{object_name}' has no data block {block_index} in stripe {stripe_index}")
+        return False
+    if len(new_data) != block_size:
+        print(f"Error: New block is {len(new_data)} bytes, expected {block_size}")
+        return False
+
+    object_id = metadata['object_id']
+    layout = object_layout(metadata)
+    nodes_online = online_flags(nodes)
+    placement = stripe_layout(layout, stripe_index, len(nodes))
+    roles = [block_index, data_disks, data_disks + 1]
+    offline = [nodes[placement[role]]['name'] for role in roles if not nodes_online[placement[role]]]
+    if offline:
+        print(f"Error: Nodes {offline} are offline, stripe {stripe_index} can't be updated")
+        return False
+
+    with StripeIO(nodes, io_depth, block_size) as stripe_io:
+        blocks = fetch_blocks(stripe_io, layout, nodes_online, object_id, {stripe_index: roles})
+        old_block, p_parity, q_parity = (blocks[(stripe_index, role)] for role in roles)
+        if old_block is not None and p_parity is not None and q_parity is not None:
+            p_parity, q_parity = update_parity(p_parity, q_parity, block_index, old_block, new_data)
+        else:
+            print(f"Reading all of stripe {stripe_index} to recompute its parity")
+            peers = {stripe_index: [role for role in range(len(nodes)) if role not in roles]}
+            blocks.update(fetch_blocks(stripe_io, layout, nodes_online, object_id, peers))
+            stripe_blocks = [blocks[(stripe_index, role)] for role in range(len(nodes))]
+            missing_indices = [i for i, block in enumerate(stripe_blocks) if block is None]
+            try:
+                data_blocks = reconstruct_stripe(stripe_blocks[:data_disks], stripe_blocks[data_disks],
+                                                 stripe_blocks[data_disks + 1], missing_indices)
+            except Exception as e:
+                print(f"Error reconstructing stripe {stripe_index}: {str(e)}")
+                return False
+            data_blocks[block_index] = new_data
+            p_parity, q_parity = raid6_stripe(data_blocks)
+
+        items = [None] * len(nodes)
+        for role, block in zip(roles, (new_data, p_parity, q_parity)):
+            items[placement[role]] = (block_key(object_id, stripe_index, role), block)
+        stored = [future.result() for future in stripe_io.submit_store(items) if future is not None]
+    block_cache.invalidate((object_id, stripe_index, block_index))
+
+    if not all(stored):
+        print(f"Error: Failed to write stripe {stripe_index}, its parity may not match its data")
+        return False
+    print(f"Updated block {block_index} of stripe {stripe_index}")
+    return True
+
+
+def chunks(iterable, n):
+    if isinstance(iterable, (list, tuple)):
+        for i in range(0, len(iterable), n):
+            yield iterable[i:i + n]
+        return
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 if __name__ == "__main__":
     while True:
-        choice = input("Choose operation: 1. Store file  2. Recover data  3. Exit ")
+        choice = input("Choose operation: 1. Store file  2. Recover data  3. List objects  4. Delete object  "
+                       "5. Exit ")
         if choice == '1':
             file_path = input("Enter the file path to store: ")
             if not os.path.exists(file_path):
@@ -151,15 +834,19 @@ if __name__ == "__main__":
                 block_size_input = input("Enter block size (e.g., 64KB, 1MB): ")
                 try:
                     block_size = parse_block_size(block_size_input)
-                    blocks, file_size = read_file_to_blocks(file_path, block_size)
                     original_filename = os.path.basename(file_path)
-                    store_raid6(blocks, file_size, original_filename, block_size)
+                    store_file(file_path, block_size)
                     print(f"File '{original_filename}' has been successfully stored in the RAID-6 system.")
                 except ValueError as e:
                     print(f"Error: {str(e)}")
         elif choice == '2':
-            recover_data()
+            recover_data(input("Enter the object name to recover: "))
         elif choice == '3':
+            for name in list_objects():
+                print(name)
+        elif choice == '4':
+            delete_object(input("Enter the object name to delete: "))
+        elif choice == '5':
             break
         else:
             print("Invalid choice")
\ No newline at end of file
@@ -15,104 +15,243 @@
 # raid6.py
 
 
-from pyfinite import ffield
+from functools import lru_cache
 
-F = ffield.FField(8)
+import numpy as np
+
+from gf256 import (FIELD_ORDER, GENERATOR, LOG_TABLE, as_array, gf_inv, gf_mul, gf_pow, mul_block, mul_block_xor,
+                    xor_blocks)
+
+# 数据块 i 的 Q 系数为 g^i；只有 i < 255 时各系数互不相同，双盘故障才可解。
+# 数据盘加上 P、Q 不超过 255 个，因此 k 最大为 253。
+MAX_DATA_DISKS = FIELD_ORDER - 2
+Q_COEFFICIENTS = tuple(gf_pow(GENERATOR, i) for i in range(MAX_DATA_DISKS))
+# 以 g 为底的对数表，用于按字节整块求出错位置
+_LOG = np.array(LOG_TABLE, dtype=np.int16)
+
+
+def _check_width(k):
+    if not 1 <= k <= MAX_DATA_DISKS:
+        raise ValueError(f"数据块数量必须在 1 到 {MAX_DATA_DISKS} 之间: {k}")
 
 
 def generate_parity(data_blocks):
-    p_parity = bytearray(len(data_blocks[0]))
-    for block in data_blocks:
-        for i in range(len(block)):
-            p_parity[i] ^= block[i]
-    return bytes(p_parity)
+    return xor_blocks(data_blocks).tobytes()
 
 
 def generate_q_parity(data_blocks):
-    q_parity = bytearray(len(data_blocks[0]))
+    _check_width(len(data_blocks))
+    q_parity = np.zeros(len(data_blocks[0]), dtype=np.uint8)
     for i, block in enumerate(data_blocks):
-        factor = field_pow(2, i)
-        for j in range(len(block)):
-            q_parity[j] = F.Add(q_parity[j], F.Multiply(block[j], factor))
-    return bytes(q_parity)
+        mul_block_xor(q_parity, Q_COEFFICIENTS[i], block)
+    return q_parity.tobytes()
 
 
 def field_pow(base, exp):
     """
-    在有限域中计算幂。
+    在有限域中计算幂（查 log/antilog 表）。
     """
-    result = 1
-    for _ in range(exp):
-        result = F.Multiply(result, base)
-    return result
+    return gf_pow(base, exp)
 
 
-def reconstruct_stripe(data_blocks, p_parity, q_parity, missing_indices):
+@lru_cache(maxsize=None)
+def double_failure_coefficients(m1, m2):
     """
-    重建 RAID-6 条带中丢失的数据块。
+    两个数据块 m1、m2 丢失时的求解系数，按丢失组合缓存，跨条带复用。
+    D_m1 = A·Q' ⊕ B·P'，D_m2 = D_m1 ⊕ P'，其中
+    A = 1 / (g^m1 ⊕ g^m2)，B = g^m2 · A。
     """
-    if len(missing_indices) > 2:
-        raise ValueError("无法恢复：丢失的块超过两个")
+    a = Q_COEFFICIENTS[m2] ^ Q_COEFFICIENTS[m1]
+    if a == 0:
+        raise ValueError("无法求解：系数为零")
+    coef_q = gf_inv(a)
+    coef_p = gf_mul(Q_COEFFICIENTS[m2], coef_q)
+    return coef_q, coef_p
 
-    block_size = len(p_parity)  # 假设所有块大小相同
-    data_blocks = [block if block is not None else bytearray(block_size) for block in data_blocks]
-
-    if len(missing_indices) == 0:
-        return data_blocks
-
-    if len(missing_indices) == 1:
-        # 使用 P 奇偶校验恢复单个丢失的块
-        missing_index = missing_indices[0]
-        reconstructed_block = bytearray(p_parity)
-        for i, block in enumerate(data_blocks):
-            if i != missing_index:
-                for j in range(block_size):
-                    reconstructed_block[j] ^= block[j]
-        data_blocks[missing_index] = bytes(reconstructed_block)
-        return data_blocks
-
-    # 处理两个丢失块的情况
-    m1, m2 = missing_indices
-
-    # 计算 P' 和 Q'
-    p_prime = bytearray(p_parity)
-    q_prime = bytearray(q_parity)
+
+def _p_prime(data_blocks, p_parity, skip):
+    """
+    P' = P ⊕ 其余数据块。
+    """
+    p_prime = as_array(p_parity).copy()
     for i, block in enumerate(data_blocks):
-        if i not in missing_indices:
-            for j in range(block_size):
-                p_prime[j] ^= block[j]
-                q_prime[j] ^= F.Multiply(block[j], field_pow(2, i))
+        if i not in skip:
+            np.bitwise_xor(p_prime, as_array(block), out=p_prime)
+    return p_prime
 
-    # 解方程重建丢失的块
-    for j in range(block_size):
-        a = F.Subtract(field_pow(2, m2), field_pow(2, m1))
-        b = F.Subtract(q_prime[j], F.Multiply(p_prime[j], field_pow(2, m2)))
 
-        if a == 0:
-            raise ValueError("无法求解：系数为零")
+def _q_prime(data_blocks, q_parity, skip):
+    """
+    Q' = Q ⊕ Σ g^i·D_i（跳过丢失的数据块）。
+    """
+    q_prime = as_array(q_parity).copy()
+    for i, block in enumerate(data_blocks):
+        if i not in skip:
+            mul_block_xor(q_prime, Q_COEFFICIENTS[i], block)
+    return q_prime
 
-        x = F.Divide(b, a)
-        y = F.Add(x, p_prime[j])
 
-        data_blocks[m1] = data_blocks[m1] or bytearray(block_size)
-        data_blocks[m2] = data_blocks[m2] or bytearray(block_size)
-        data_blocks[m1][j] = x
-        data_blocks[m2][j] = y
+def reconstruct_full_stripe(blocks, missing_indices):
+    """
+    重建完整条带（k 个数据块 + P + Q）中任意不超过两个丢失的块。
+    blocks[k] 为 P，blocks[k + 1] 为 Q，丢失的块可为 None。
+    总是选用代价最低的方程：单个数据块优先用 P（仅异或），
+    P 也丢失时用 Q 做一次整块 GF 除法；丢失的校验块最后重新生成。
+    """
+    missing = sorted(set(missing_indices))
+    if len(missing) > 2:
+        raise ValueError("无法恢复：丢失的块超过两个")
+
+    k = len(blocks) - 2
+    _check_width(k)
+    p_index, q_index = k, k + 1
+    if any(index < 0 or index > q_index for index in missing):
+        raise ValueError(f"无效的块索引: {missing}")
+
+    blocks = list(blocks)
+    if not missing:
+        return blocks
+
+    data_blocks = blocks[:k]
+    p_parity, q_parity = blocks[p_index], blocks[q_index]
+    missing_data = [index for index in missing if index < k]
 
-    return data_blocks
+    if len(missing_data) == 1:
+        d = missing_data[0]
+        if p_index not in missing:
+            recovered = _p_prime(data_blocks, p_parity, missing_data)
+        else:
+            # P 丢失：D_d = Q' / g^d
+            recovered = mul_block(gf_inv(Q_COEFFICIENTS[d]), _q_prime(data_blocks, q_parity, missing_data))
+        blocks[d] = recovered.tobytes()
+    elif len(missing_data) == 2:
+        m1, m2 = missing_data
+        coef_q, coef_p = double_failure_coefficients(m1, m2)
+        p_prime = _p_prime(data_blocks, p_parity, missing_data)
+        q_prime = _q_prime(data_blocks, q_parity, missing_data)
+
+        # 整块查表解方程重建丢失的块
+        x = mul_block(coef_q, q_prime)
+        mul_block_xor(x, coef_p, p_prime)
+        y = np.bitwise_xor(x, p_prime)
+        blocks[m1] = x.tobytes()
+        blocks[m2] = y.tobytes()
+
+    if p_index in missing:
+        blocks[p_index] = generate_parity(blocks[:k])
+    if q_index in missing:
+        blocks[q_index] = generate_q_parity(blocks[:k])
+    return blocks
+
+
+def rebuild_block(blocks, index):
+    """
+    只重建完整条带中的第 index 个块，blocks 中为 None 的块视为丢失（含 index，最多两个）。
+    与 reconstruct_full_stripe 不同，未请求的校验块即使丢失也不会重新生成：
+    重建校验块只需数据块，重建数据块在 P 可用时只需异或。
+    """
+    k = len(blocks) - 2
+    _check_width(k)
+    missing = [i for i, block in enumerate(blocks) if block is None]
+    data_missing = [i for i in missing if i < k]
+    if not data_missing and index == k:
+        return generate_parity(blocks[:k])
+    if not data_missing and index == k + 1:
+        return generate_q_parity(blocks[:k])
+    if data_missing == [index] and blocks[k] is not None:
+        return _p_prime(blocks[:k], blocks[k], data_missing).tobytes()
+    return reconstruct_full_stripe(blocks, missing)[index]
+
+
+def reconstruct_stripe(data_blocks, p_parity, q_parity, missing_indices):
+    """
+    重建 RAID-6 条带中丢失的数据块。
+    missing_indices 可包含 P（len(data_blocks)）和 Q（len(data_blocks) + 1）的索引。
+    """
+    blocks = reconstruct_full_stripe(list(data_blocks) + [p_parity, q_parity], missing_indices)
+    return blocks[:len(data_blocks)]
 
 
 def raid6_stripe(data_blocks):
     """
     为给定的数据块生成 RAID-6 校验。
+    每个数据块整体查表乘以 g^i，再用 np.bitwise_xor 累加。
     """
+    _check_width(len(data_blocks))
     block_size = len(data_blocks[0])
-    p_parity = bytearray(block_size)
-    q_parity = bytearray(block_size)
+    p_parity = np.zeros(block_size, dtype=np.uint8)
+    q_parity = np.zeros(block_size, dtype=np.uint8)
+
+    for i, block in enumerate(data_blocks):
+        block = as_array(block)
+        np.bitwise_xor(p_parity, block, out=p_parity)
+        mul_block_xor(q_parity, Q_COEFFICIENTS[i], block)
+
+    return p_parity.tobytes(), q_parity.tobytes()
+
+
+def update_parity(p_parity, q_parity, index, old_block, new_block):
+    """
+    数据块 index 由 old_block 改为 new_block 时增量更新校验，无需读取条带中的其他数据块。
+    令 Δ = old ⊕ new，则 P' = P ⊕ Δ，Q' = Q ⊕ g^index·Δ。
+    """
+    if not 0 <= index < MAX_DATA_DISKS:
+        raise ValueError(f"无效的数据块索引: {index}")
+    delta = np.bitwise_xor(as_array(old_block), as_array(new_block))
+    p_parity = np.bitwise_xor(as_array(p_parity), delta)
+    q_parity = mul_block_xor(as_array(q_parity).copy(), Q_COEFFICIENTS[index], delta)
+    return p_parity.tobytes(), q_parity.tobytes()
+
 
+def syndromes(data_blocks, p_parity, q_parity):
+    """
+    计算条带的 P、Q 校验子：Psyn = P ⊕ ΣD_i，Qsyn = Q ⊕ Σg^i·D_i。
+    条带一致时二者全为零，计算量与一次编码相同。
+    """
+    _check_width(len(data_blocks))
+    p_syndrome = as_array(p_parity).copy()
+    q_syndrome = as_array(q_parity).copy()
     for i, block in enumerate(data_blocks):
-        for j in range(block_size):
-            p_parity[j] ^= block[j]
-            q_parity[j] ^= F.Multiply(block[j], field_pow(2, i))
+        block = as_array(block)
+        np.bitwise_xor(p_syndrome, block, out=p_syndrome)
+        mul_block_xor(q_syndrome, Q_COEFFICIENTS[i], block)
+    return p_syndrome, q_syndrome
+
+
+def correct_stripe(data_blocks, p_parity, q_parity):
+    """
+    校验整条读出的条带，定位并纠正其中单个出错的块（数据块、P 或 Q），无需校验和。
+    返回 (blocks, index)：blocks 为纠正后的 k + 2 个块，index 为被纠正的块，条带一致时为 None。
+    数据块 z 出错 e 时 Psyn = e、Qsyn = g^z·e，故每个出错字节都满足 z = log Qsyn − log Psyn；
+    各字节给出的 z 不一致时说明不止一个块出错，无法定位，抛出 ValueError。
+    """
+    k = len(data_blocks)
+    p_syndrome, q_syndrome = syndromes(data_blocks, p_parity, q_parity)
+    p_bad, q_bad = p_syndrome.any(), q_syndrome.any()
+    blocks = list(data_blocks) + [p_parity, q_parity]
+    if not p_bad and not q_bad:
+        return blocks, None
+    if not q_bad:
+        # 只有 P 不一致：P 本身出错
+        blocks[k] = np.bitwise_xor(as_array(p_parity), p_syndrome).tobytes()
+        return blocks, k
+    if not p_bad:
+        blocks[k + 1] = np.bitwise_xor(as_array(q_parity), q_syndrome).tobytes()
+        return blocks, k + 1
+
+    nonzero = p_syndrome != 0
+    if not np.array_equal(nonzero, q_syndrome != 0):
+        raise ValueError("无法定位：不止一个块出错")
+    z = (_LOG[q_syndrome[nonzero]] - _LOG[p_syndrome[nonzero]]) % FIELD_ORDER
+    index = int(z[0])
+    if index >= k or not (z == index).all():
+        raise ValueError("无法定位：不止一个块出错")
+    blocks[index] = np.bitwise_xor(as_array(data_blocks[index]), p_syndrome).tobytes()
+    return blocks, index
 
-    return bytes(p_parity), bytes(q_parity)
\ No newline at end of file
+
+def raid6_stripe_batch(stripes):
+    """
+    批量计算多个条带的校验，供多进程编码流水线按批提交以摊薄进程间通信开销。
+    """
+    return [raid6_stripe(stripe_blocks) for stripe_blocks in stripes]
@@ -0,0 +1,408 @@
+# !/usr/bin/env python
+# -*-coding:utf-8 -*-
+
+"""
+# @File     : rebuild.py
+# @Project  : raid6
+# Time      : 17/10/26 9:40 pm
+# Author    : honywen
+# version   : python 3.8
+# Description：Repopulate a replaced storage node from the surviving nodes
+"""
+
+
+# rebuild.py
+
+import os
+import sys
+import json
+import time
+from collections import deque
+from storage_manager import (LIST_PAGE_SIZE, StripeIO, check_node_online, list_metadata, put_metadata, scrub_status,
+                             start_scrub)
+from raid6 import correct_stripe, rebuild_block
+from layout import node_roles, stripe_layout
+from main import (IO_DEPTH, STORAGE_NODES, block_cache, block_key, chunks, fetch_blocks, fetch_stripes,
+                  list_objects, lookup_object, object_geometry, object_id_for, object_layout, online_flags,
+                  parse_block_key, parse_block_size, stat_object, stripes_per_request)
+
+REBUILD_RATE_LIMIT = 0                     # bytes/s written to the rebuilt node, 0 for no limit
+REBUILD_CHECKPOINT = 'rebuild_{}.json'     # progress file of a rebuild, per node name
+CHECKPOINT_INTERVAL = 1                    # seconds between checkpoint writes
+SCRUB_POLL_INTERVAL = 1                    # seconds between scrub status checks
+
+
+class RateLimiter:
+    """
+    Keep the average throughput since the limiter was created at or below
+    bytes_per_second; 0 disables the limit.
+    """
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.start = time.monotonic()
+        self.total = 0
+
+    def wait(self, nbytes):
+        if not self.bytes_per_second:
+            return
+        self.total += nbytes
+        delay = self.start + self.total / self.bytes_per_second - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def load_checkpoint(path, node_name):
+    """
+    Progress of an interrupted rebuild of node_name, or a fresh state.
+    'after' is the last object finished; 'stripe' is the next stripe of
+    'object', the object being rebuilt when the checkpoint was written.
+    """
+    if not os.path.exists(path):
+        return {'node': node_name, 'after': '', 'object': None, 'stripe': 0, 'blocks': 0, 'bytes': 0}
+    with open(path) as f:
+        state = json.load(f)
+    if state['node'] != node_name:
+        raise ValueError(f"Checkpoint {path} belongs to a rebuild of {state['node']}, not {node_name}")
+    return state
+
+
+def save_checkpoint(path, state):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+
+def rebuild_roles(role, data_disks):
+    """
+    Roles read to rebuild a block: the other data blocks and P for a data
+    block, the data blocks for P or Q. The remaining parity is read only if one
+    of these can't be.
+    """
+    if role < data_disks:
+        return [i for i in range(data_disks) if i != role] + [data_disks]
+    return range(data_disks)
+
+
+def rebuild_object(metadata, position, first_stripe, limiter, progress, io_depth=IO_DEPTH):
+    """
+    Rebuild the blocks the node at `position` of the object's node list holds,
+    from first_stripe on, and write them back to it. Reads run io_depth
+    MRETRIEVE batches ahead and writes io_depth MSTORE batches behind.
+    progress(next_stripe, blocks, nbytes) is called as each batch is stored.
+    Returns the number of stripes that could not be rebuilt, or None if the
+    node stopped accepting writes.
+    """
+    object_id = metadata['object_id']
+    layout = object_layout(metadata)
+    data_disks, nodes = object_geometry(metadata)
+    total_disks = len(nodes)
+    nodes_online = online_flags(nodes)
+    # The blocks on the node being rebuilt are missing or stale
+    nodes_online[position] = False
+
+    def target_role(stripe_index):
+        return node_roles(layout, stripe_index, total_disks)[position]
+
+    def roles_for(stripe_index):
+        return rebuild_roles(target_role(stripe_index), data_disks)
+
+    failed = 0
+    writing = deque()
+    with StripeIO(nodes, io_depth, metadata['block_size']) as stripe_io:
+        fetched = fetch_stripes(stripe_io, layout, nodes_online, object_id, metadata['total_stripes'],
+                                stripes_per_request(metadata['block_size']), io_depth, roles_for, first_stripe)
+        for group in chunks(fetched, stripes_per_request(metadata['block_size'])):
+            items = []
+            for stripe_index, blocks in group:
+                role = target_role(stripe_index)
+                read = roles_for(stripe_index)
+                if any(blocks[i] is None for i in read):
+                    others = {stripe_index: [i for i in range(total_disks) if i != role and i not in read]}
+                    for (_, i), block in fetch_blocks(stripe_io, layout, nodes_online, object_id, others).items():
+                        blocks[i] = block
+                try:
+                    items.append((block_key(object_id, stripe_index, role), rebuild_block(blocks, role)))
+                except ValueError as e:
+                    print(f"Error rebuilding block {role} of stripe {stripe_index}: {str(e)}")
+                    failed += 1
+
+            nbytes = sum(len(block) for _, block in items)
+            limiter.wait(nbytes)
+            requests = [None] * total_disks
+            requests[position] = items
+            future = stripe_io.submit_store_batch(requests)[position] if items else None
+            writing.append((group[-1][0] + 1, len(items), nbytes, future))
+            while len(writing) >= io_depth:
+                if not _finish_write(nodes[position], progress, *writing.popleft()):
+                    return None
+        while writing:
+            if not _finish_write(nodes[position], progress, *writing.popleft()):
+                return None
+    return failed
+
+
+def _finish_write(node, progress, next_stripe, blocks, nbytes, future):
+    if future is not None and not all(future.result()):
+        print(f"Error: Failed to write rebuilt blocks to node {node['name']}")
+        return False
+    progress(next_stripe, blocks, nbytes)
+    return True
+
+
+def _node_and_sources(node_name):
+    """
+    Return the configured node named node_name and the other online nodes, or
+    (None, None) if the node is unknown or offline or no other node is online.
+    """
+    target = next((node for node in STORAGE_NODES if node['name'] == node_name), None)
+    if target is None:
+        print(f"Error: Node {node_name} is not in the cluster config")
+        return None, None
+    if not check_node_online(target):
+        print(f"Error: Node {node_name} is offline")
+        return None, None
+    sources = [node for node in STORAGE_NODES if node is not target and check_node_online(node)]
+    if not sources:
+        print("Error: No other node is online")
+        return None, None
+    return target, sources
+
+
+def rebuild_node(node_name, io_depth=IO_DEPTH, rate_limit=REBUILD_RATE_LIMIT, checkpoint_path=None):
+    """
+    Repopulate the node named node_name, e.g. after it was replaced by an empty
+    one, from the other nodes: every block it holds in every object is
+    reconstructed, written back, and each object's metadata is restored last.
+
+    Progress is checkpointed to checkpoint_path (rebuild_<node>.json by
+    default); calling again after an interruption resumes where it stopped.
+    rate_limit caps the bytes per second written to the node. Returns True if
+    every block was rebuilt.
+    """
+    checkpoint_path = checkpoint_path or REBUILD_CHECKPOINT.format(node_name)
+    target, sources = _node_and_sources(node_name)
+    if target is None:
+        return False
+
+    state = load_checkpoint(checkpoint_path, node_name)
+    if state['object'] is not None:
+        print(f"Resuming rebuild of {node_name} at '{state['object']}' stripe {state['stripe']}")
+    limiter = RateLimiter(rate_limit)
+    started, start_bytes = time.monotonic(), state['bytes']
+    last_saved = started
+    failed = 0
+
+    def progress(next_stripe, blocks, nbytes):
+        nonlocal last_saved
+        state.update(stripe=next_stripe, blocks=state['blocks'] + blocks, bytes=state['bytes'] + nbytes)
+        if time.monotonic() - last_saved >= CHECKPOINT_INTERVAL:
+            save_checkpoint(checkpoint_path, state)
+            last_saved = time.monotonic()
+
+    start_after = state['after']
+    while True:
+        page = list_metadata(sources[0], start_after, LIST_PAGE_SIZE)
+        if page is None:
+            save_checkpoint(checkpoint_path, state)
+            print(f"Rebuild stopped, run it again to resume from {checkpoint_path}")
+            return False
+        for object_name in page:
+            metadata = lookup_object(object_name, sources)
+            if not metadata:
+                print(f"Error: Could not retrieve metadata of '{object_name}' from any node")
+                failed += 1
+                continue
+            _, nodes = object_geometry(metadata)
+            names = [node['name'] for node in nodes]
+            if node_name in names:
+                first_stripe = state['stripe'] if state['object'] == object_name else 0
+                state.update(object=object_name, stripe=first_stripe)
+                print(f"Rebuilding '{object_name}' from stripe {first_stripe} of {metadata['total_stripes']}")
+                object_failed = rebuild_object(metadata, names.index(node_name), first_stripe, limiter, progress,
+                                               io_depth)
+                if object_failed is None:
+                    save_checkpoint(checkpoint_path, state)
+                    print(f"Rebuild stopped, run it again to resume from {checkpoint_path}")
+                    return False
+                failed += object_failed
+                if not put_metadata(target, object_name, json.dumps(metadata).encode()):
+                    print(f"Error: Failed to store metadata of '{object_name}' on node {node_name}")
+                    failed += 1
+            state.update(after=object_name, object=None, stripe=0)
+            save_checkpoint(checkpoint_path, state)
+            last_saved = time.monotonic()
+        if len(page) < LIST_PAGE_SIZE:
+            break
+        start_after = page[-1]
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    elapsed = time.monotonic() - started
+    written = state['bytes'] - start_bytes
+    print(f"Rebuilt {state['blocks']} blocks ({state['bytes']} bytes) on {node_name} "
+          f"in {elapsed:.1f}s, {written / max(elapsed, 1e-9) / (1024 * 1024):.1f} MB/s")
+    if failed:
+        print(f"Error: {failed} blocks or objects could not be rebuilt")
+    return failed == 0
+
+
+def repair_object(metadata, position, damaged, io_depth=IO_DEPTH):
+    """
+    Rebuild the (stripe_index, role) blocks in damaged, all held by the node at
+    `position` of the object's node list, from the other nodes and write them
+    back to it. Returns the number of blocks that could not be repaired.
+    """
+    object_id = metadata['object_id']
+    layout = object_layout(metadata)
+    _, nodes = object_geometry(metadata)
+    total_disks = len(nodes)
+    nodes_online = online_flags(nodes)
+    nodes_online[position] = False
+    failed = 0
+    with StripeIO(nodes, io_depth, metadata['block_size']) as stripe_io:
+        for group in chunks(sorted(damaged), stripes_per_request(metadata['block_size'])):
+            wanted = {stripe_index: [i for i in range(total_disks) if i != role] for stripe_index, role in group}
+            blocks = fetch_blocks(stripe_io, layout, nodes_online, object_id, wanted)
+            items = []
+            for stripe_index, role in group:
+                stripe_blocks = [blocks.get((stripe_index, i)) for i in range(total_disks)]
+                try:
+                    items.append((block_key(object_id, stripe_index, role), rebuild_block(stripe_blocks, role)))
+                except ValueError as e:
+                    print(f"Error rebuilding block {role} of stripe {stripe_index}: {str(e)}")
+                    failed += 1
+            if items:
+                requests = [None] * total_disks
+                requests[position] = items
+                failed += stripe_io.submit_store_batch(requests)[position].result().count(False)
+    return failed
+
+
+def scrub_node(node_name, io_depth=IO_DEPTH):
+    """
+    Have the node check every block against its checksum on its own disk, then
+    rebuild the blocks found corrupt from the other nodes and write them back.
+    Returns True if the node ends up with no known corrupt blocks.
+    """
+    target, sources = _node_and_sources(node_name)
+    if target is None or not start_scrub(target):
+        return False
+    while True:
+        status = scrub_status(target)
+        if status is None:
+            return False
+        if not status['running']:
+            break
+        print(f"Scrubbing {node_name}: {status['checked']}/{status['total']} blocks checked")
+        time.sleep(SCRUB_POLL_INTERVAL)
+    print(f"Scrubbed {status['total']} blocks on {node_name}, {len(status['corrupt'])} corrupt")
+    if not status['corrupt']:
+        return True
+
+    damaged = {}
+    # Blocks whose name is no object's block key can't be traced to a stripe
+    unrepairable = []
+    for name in status['corrupt']:
+        key = parse_block_key(name)
+        if key is None:
+            unrepairable.append(name)
+            continue
+        object_id, stripe_index, role = key
+        damaged.setdefault(object_id, []).append((stripe_index, role))
+    failed = 0
+    start_after = ''
+    while damaged:
+        page = list_metadata(sources[0], start_after, LIST_PAGE_SIZE)
+        if page is None:
+            return False
+        for object_name in page:
+            object_id = object_id_for(object_name)
+            if object_id not in damaged:
+                continue
+            metadata = lookup_object(object_name, sources)
+            if not metadata:
+                print(f"Error: Could not retrieve metadata of '{object_name}' from any node")
+                continue
+            _, nodes = object_geometry(metadata)
+            position = [node['name'] for node in nodes].index(node_name)
+            print(f"Repairing {len(damaged[object_id])} blocks of '{object_name}'")
+            failed += repair_object(metadata, position, damaged.pop(object_id), io_depth)
+        if len(page) < LIST_PAGE_SIZE:
+            break
+        start_after = page[-1]
+    if damaged:
+        print(f"Error: Corrupt blocks of unknown objects: {sorted(damaged)}")
+    if unrepairable:
+        print(f"Error: Corrupt blocks that belong to no object can't be repaired: {unrepairable}")
+    if failed:
+        print(f"Error: {failed} blocks could not be repaired")
+    return not failed and not damaged and not unrepairable
+
+
+def verify_object(object_name, repair=True, io_depth=IO_DEPTH):
+    """
+    Read every block of object_name and check each stripe against its P and Q
+    syndromes. This needs no checksums, so it also covers objects stored
+    before they were kept. A single bad block in a stripe, data or parity, is
+    located from the syndromes and, with repair, rewritten to its node.
+    Returns the number of stripes left unverified or uncorrectable, or None if
+    the object can't be found.
+    """
+    metadata = stat_object(object_name)
+    if not metadata:
+        print(f"Error: Could not retrieve metadata of '{object_name}' from any node")
+        return None
+    object_id = metadata['object_id']
+    layout = object_layout(metadata)
+    data_disks, nodes = object_geometry(metadata)
+    total_disks = len(nodes)
+    nodes_online = online_flags(nodes)
+    bad = 0
+    corrected = 0
+    with StripeIO(nodes, io_depth, metadata['block_size']) as stripe_io:
+        fetched = fetch_stripes(stripe_io, layout, nodes_online, object_id, metadata['total_stripes'],
+                                stripes_per_request(metadata['block_size']), io_depth, hedge=False)
+        for group in chunks(fetched, stripes_per_request(metadata['block_size'])):
+            requests = [[] for _ in nodes]
+            for stripe_index, blocks in group:
+                if any(block is None for block in blocks):
+                    print(f"Stripe {stripe_index} can't be verified, not all of its blocks could be read")
+                    bad += 1
+                    continue
+                try:
+                    blocks, index = correct_stripe(blocks[:data_disks], blocks[data_disks], blocks[data_disks + 1])
+                except ValueError as e:
+                    print(f"Error in stripe {stripe_index}: {str(e)}")
+                    bad += 1
+                    continue
+                if index is not None:
+                    print(f"Block {index} of stripe {stripe_index} is corrupt")
+                    corrected += 1
+                    node = stripe_layout(layout, stripe_index, total_disks)[index]
+                    requests[node].append((block_key(object_id, stripe_index, index), blocks[index]))
+                    block_cache.invalidate((object_id, stripe_index, index))
+            if repair and any(requests):
+                futures = stripe_io.submit_store_batch([items or None for items in requests])
+                for future in futures:
+                    if future is not None:
+                        bad += future.result().count(False)
+    print(f"Verified {metadata['total_stripes']} stripes of '{object_name}': {corrected} corrupt blocks "
+          f"{'repaired' if repair else 'found'}, {bad} stripes not verified or not repaired")
+    return bad
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == '--scrub':
+        sys.exit(0 if scrub_node(sys.argv[2]) else 1)
+    if len(sys.argv) in (2, 3) and sys.argv[1] == '--verify':
+        results = [verify_object(name) for name in sys.argv[2:] or list_objects()]
+        sys.exit(0 if all(result == 0 for result in results) else 1)
+    if len(sys.argv) < 2:
+        print("Usage: python rebuild.py <node name> [rate limit per second, e.g. 100MB]")
+        print("       python rebuild.py --scrub <node name>")
+        print("       python rebuild.py --verify [object name]")
+        sys.exit(1)
+    rate_limit = parse_block_size(sys.argv[2]) if len(sys.argv) > 2 else REBUILD_RATE_LIMIT
+    sys.exit(0 if rebuild_node(sys.argv[1], rate_limit=rate_limit) else 1)
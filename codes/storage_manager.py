@@ -4,7 +4,7 @@
 """
 # @File     : storage_manager.py
 # @Project  : raid6
-# Time      : 14/9/24 2:46 pm
+# Time      : 14/9/24 2:46 pm
 # Author    : honywen
 # version   : python 3.8
 # Description：
@@ -15,71 +15,598 @@
 # storage_manager.py
 
 import socket
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+from framing import BufferedReader
+
+CONNECT_TIMEOUT = 2
+IO_TIMEOUT = 30
+MAX_IDLE_CONNECTIONS = 8      # idle keep-alive connections kept per node
+IDLE_TIMEOUT = 60             # seconds before an idle pooled connection is dropped
+HEALTH_TTL = 5                # seconds a successful request vouches for a node
+RETRY_OFFLINE_AFTER = 5       # seconds before a failed node is probed again
+PIPELINE_DEPTH = 16           # requests in flight on one connection
+NODE_IO_DEPTH = 4             # stripes in flight per node in StripeIO
+MAX_BATCH_BLOCKS = 256        # blocks carried by one MSTORE/MRETRIEVE
+MAX_SEND_BUFFERS = 1024       # buffers handed to one sendmsg() call (IOV_MAX)
+LIST_PAGE_SIZE = 1000         # object names fetched per LISTMETA
+HEDGE_PERCENTILE = 95         # reads slower than this percentile are hedged, 0 to never hedge
+HEDGE_MIN_DELAY = 0.02        # seconds a read is always given before it is hedged
+LATENCY_SAMPLES = 64          # recent read latencies per node the hedging deadline is taken from
+
+
+class NodeConnection:
+    def __init__(self, node):
+        self.sock = socket.create_connection((node['host'], node['port']), timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(IO_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.reader = BufferedReader(self.sock)
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def send(self, command, data=None):
+        """
+        Send a command line and its payload; a list payload is sent as a batch
+        of buffers following the command.
+        """
+        if isinstance(data, list):
+            self.send_parts([command.encode('utf-8')] + data)
+            return
+        self.sock.sendall(command.encode('utf-8'))
+        if data:
+            self.sock.sendall(data)
+
+    def send_parts(self, parts):
+        """
+        Gather-send many small buffers with as few sendmsg() calls as possible.
+        """
+        if not hasattr(self.sock, 'sendmsg'):
+            for part in parts:
+                self.sock.sendall(part)
+            return
+        views = deque(memoryview(part).cast('B') for part in parts if len(part))
+        while views:
+            sent = self.sock.sendmsg([views[i] for i in range(min(len(views), MAX_SEND_BUFFERS))])
+            while sent and sent >= len(views[0]):
+                sent -= len(views.popleft())
+            if sent:
+                views[0] = views[0][sent:]
+
+    def readline(self):
+        response = self.reader.readline()
+        if not response:
+            raise ConnectionError('connection closed by node')
+        return response
+
+    def read_exact(self, size):
+        return self.reader.read_exact(size)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections per node plus the node health derived from them.
+
+    A node that just served a request is considered online without a probe; a
+    node whose connection failed is reported offline until RETRY_OFFLINE_AFTER
+    has passed, after which the next caller probes it with PING.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._health = {}
+
+    @staticmethod
+    def _key(node):
+        return node['host'], node['port']
+
+    def acquire(self, node):
+        key = self._key(node)
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn = idle.pop()
+                if now - conn.last_used < IDLE_TIMEOUT:
+                    conn.reused = True
+                    return conn
+                conn.close()
+        return NodeConnection(node)
+
+    def release(self, node, conn):
+        conn.last_used = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault(self._key(node), deque())
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def mark_online(self, node):
+        with self._lock:
+            self._health[self._key(node)] = (True, time.monotonic())
+
+    def drop_idle(self, node):
+        with self._lock:
+            idle = self._idle.pop(self._key(node), None)
+        for conn in idle or ():
+            conn.close()
+
+    def mark_offline(self, node):
+        with self._lock:
+            self._health[self._key(node)] = (False, time.monotonic())
+        self.drop_idle(node)
+
+    def cached_health(self, node):
+        """
+        Return True/False while the last observation is fresh, otherwise None.
+        """
+        with self._lock:
+            online, checked = self._health.get(self._key(node), (None, 0))
+        age = time.monotonic() - checked
+        if online and age < HEALTH_TTL:
+            return True
+        if online is False and age < RETRY_OFFLINE_AFTER:
+            return False
+        return None
+
+
+_pool = ConnectionPool()
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent reads from each node, from which the hedging
+    deadline is taken. Reads are told apart by size, within a factor of 4, so
+    the deadline of a large read isn't learned from small ones.
+    """
+
+    def __init__(self, size=LATENCY_SAMPLES):
+        self._lock = threading.Lock()
+        self._size = size
+        self._samples = {}
+
+    @staticmethod
+    def _size_class(nbytes):
+        return max(nbytes, 1).bit_length() // 2
+
+    def record(self, node, nbytes, seconds):
+        key = ConnectionPool._key(node), self._size_class(nbytes)
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self._size)).append(seconds)
+
+    def percentile(self, nbytes, percent):
+        """
+        Return the given percentile of the median node's latencies for reads of
+        about nbytes, so a few slow nodes don't raise the deadline their own
+        reads are held to. Nodes with less than a quarter of the sample window
+        are left out; None if there are none.
+        """
+        size_class = self._size_class(nbytes)
+        with self._lock:
+            windows = [sorted(samples) for (_, key_class), samples in self._samples.items()
+                       if key_class == size_class and len(samples) >= self._size // 4]
+        if not windows:
+            return None
+        latencies = sorted(samples[min(len(samples) - 1, len(samples) * percent // 100)] for samples in windows)
+        return latencies[len(latencies) // 2]
+
+
+read_latency = LatencyTracker()
+
+
+def hedge_deadline(nbytes):
+    """
+    Seconds after which an outstanding read of nbytes should be hedged, or
+    None if reads are not hedged (disabled, or too few reads of that size seen
+    yet to know what is slow).
+    """
+    if not HEDGE_PERCENTILE:
+        return None
+    latency = read_latency.percentile(nbytes, HEDGE_PERCENTILE)
+    return None if latency is None else max(latency, HEDGE_MIN_DELAY)
+
+
+def request(node, exchange):
+    """
+    Run exchange(conn) on a pooled connection to node.
+
+    A reused connection may have been closed by the node while idle, so a
+    failure on one is retried once on a fresh connection before the node is
+    marked offline.
+    """
+    for attempt in range(2):
+        try:
+            conn = _pool.acquire(node)
+        except OSError:
+            _pool.mark_offline(node)
+            raise
+        try:
+            result = exchange(conn)
+        except (OSError, ConnectionError):
+            conn.close()
+            if conn.reused and attempt == 0:
+                # Other idle connections to this node are likely stale as well
+                _pool.drop_idle(node)
+                continue
+            _pool.mark_offline(node)
+            raise
+        except BaseException:
+            conn.close()
+            raise
+        _pool.release(node, conn)
+        _pool.mark_online(node)
+        return result
 
 
 def check_node_online(node):
+    health = _pool.cached_health(node)
+    if health is not None:
+        return health
+
+    def ping(conn):
+        conn.send('PING\n')
+        return conn.readline()
+
     try:
-        with socket.create_connection((node['host'], node['port']), timeout=2):
-            return True
-    except (socket.timeout, ConnectionRefusedError):
+        return request(node, ping) == 'PONG'
+    except (OSError, ConnectionError):
         return False
 
 def send_command(host, port, command, data=None):
-    response = ''
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((host, port))
-        s.sendall(command.encode('utf-8'))
-        if data:
-            s.sendall(data)
-        response_line = ''
-        while not response_line.endswith('\n'):
-            chunk = s.recv(1).decode('utf-8')
-            if not chunk:
-                break
-            response_line += chunk
-        response = response_line.strip()
-    return response
+    def exchange(conn):
+        conn.send(command, data)
+        return conn.readline()
+
+    return request({'host': host, 'port': port}, exchange)
+
+def _read_retrieve_response(conn):
+    """
+    Read an `OK <size> [<crc>]` answer and its payload. A block whose CRC-32
+    doesn't match the one the node stored with it is returned as None, so
+    callers treat it like a missing block.
+    """
+    response = conn.readline()
+    if response.startswith('OK'):
+        _, filesize_str, *crc = response.split()
+        data = conn.read_exact(int(filesize_str))
+        if crc and zlib.crc32(data) != int(crc[0]):
+            return 'ERROR Checksum mismatch', None
+        return response, data
+    return response, None
 
 def store_block(node, filename, data):
     host, port = node['host'], node['port']
-    command = f'STORE {filename} {len(data)}\n'
+    command = f'STORE {filename} {len(data)} {zlib.crc32(data)}\n'
     try:
         response = send_command(host, port, command, data)
         if response != 'OK':
             print(f'Error storing block {filename} on {node["name"]}: {response}')
-        else:
-            print(f'Successfully stored block {filename} on {node["name"]}')
+            return False
+        print(f'Successfully stored block {filename} on {node["name"]}')
+        return True
     except Exception as e:
         print(f'Failed to store block {filename} on {node["name"]}: {str(e)}')
+        return False
 
 def retrieve_block(node, filename):
-    host, port = node['host'], node['port']
     command = f'RETRIEVE {filename}\n'
+
+    def exchange(conn):
+        conn.send(command)
+        return _read_retrieve_response(conn)
+
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((host, port))
-            s.sendall(command.encode('utf-8'))
-            response_line = ''
-            while not response_line.endswith('\n'):
-                chunk = s.recv(1).decode('utf-8')
-                if not chunk:
-                    break
-                response_line += chunk
-            response = response_line.strip()
-            if response.startswith('OK'):
-                _, filesize_str = response.split()
-                filesize = int(filesize_str)
-                data = b''
-                while len(data) < filesize:
-                    packet = s.recv(min(filesize - len(data), 4096))
-                    if not packet:
-                        break
-                    data += packet
-                print(f'Successfully retrieved block {filename} from {node["name"]}')
-                return data
-            else:
-                print(f'Error retrieving block {filename} from {node["name"]}: {response}')
-                return None
+        response, data = request(node, exchange)
+        if data is not None:
+            print(f'Successfully retrieved block {filename} from {node["name"]}')
+            return data
+        print(f'Error retrieving block {filename} from {node["name"]}: {response}')
+        return None
     except Exception as e:
         print(f'Failed to retrieve block {filename} from {node["name"]}: {str(e)}')
-        return None
\ No newline at end of file
+        return None
+
+def _pipeline(conn, commands, read_response, depth):
+    """
+    Keep up to `depth` requests in flight on one connection; the node answers
+    them in order, so responses are matched to commands by position.
+    """
+    results = []
+    pending = 0
+    for command, data in commands:
+        conn.send(command, data)
+        pending += 1
+        if pending >= depth:
+            results.append(read_response(conn))
+            pending -= 1
+    while pending:
+        results.append(read_response(conn))
+        pending -= 1
+    return results
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _mstore_command(items):
+    parts = []
+    for filename, data in items:
+        parts.append(f'{filename} {len(data)} {zlib.crc32(data)}\n'.encode('utf-8'))
+        parts.append(data)
+    return f'MSTORE {len(items)}\n', parts
+
+def _mretrieve_command(filenames):
+    return f'MRETRIEVE {len(filenames)}\n' + ''.join(f'{filename}\n' for filename in filenames), None
+
+def store_blocks_batch(node, items, batch_blocks=MAX_BATCH_BLOCKS, depth=PIPELINE_DEPTH):
+    """
+    Store (filename, data) pairs on one node with MSTORE, batch_blocks per
+    command and up to depth commands pipelined on one connection.
+    Returns a list of booleans, one per item.
+    """
+    items = list(items)
+    batches = list(_batches(items, batch_blocks))
+    commands = [_mstore_command(batch) for batch in batches]
+    try:
+        responses = request(node, lambda conn: _pipeline(conn, commands, NodeConnection.readline, depth))
+    except Exception as e:
+        print(f'Failed to store {len(items)} blocks on {node["name"]}: {str(e)}')
+        return [False] * len(items)
+    results = []
+    for batch, response in zip(batches, responses):
+        if response != 'OK':
+            print(f'Error storing {len(batch)} blocks on {node["name"]}: {response}')
+        results.extend([response == 'OK'] * len(batch))
+    return results
+
+def retrieve_blocks_batch(node, filenames, batch_blocks=MAX_BATCH_BLOCKS, depth=PIPELINE_DEPTH):
+    """
+    Retrieve blocks from one node with MRETRIEVE, batch_blocks per command and
+    up to depth commands pipelined on one connection.
+    Returns a list with the block data, or None for blocks that failed.
+    """
+    filenames = list(filenames)
+    batches = list(_batches(filenames, batch_blocks))
+    commands = [_mretrieve_command(batch) for batch in batches]
+
+    def exchange(conn):
+        sizes = iter([len(batch) for batch in batches])
+        return _pipeline(conn, commands, lambda conn: [_read_retrieve_response(conn) for _ in range(next(sizes))],
+                         depth)
+
+    try:
+        responses = request(node, exchange)
+    except Exception as e:
+        print(f'Failed to retrieve {len(filenames)} blocks from {node["name"]}: {str(e)}')
+        return [None] * len(filenames)
+    results = []
+    for filename, (response, data) in zip(filenames, (entry for batch in responses for entry in batch)):
+        if data is None:
+            print(f'Error retrieving block {filename} from {node["name"]}: {response}')
+        results.append(data)
+    return results
+
+def delete_blocks(node, filenames, depth=PIPELINE_DEPTH):
+    """
+    Delete blocks from one node with up to depth DELETE commands pipelined on
+    one connection. Blocks the node doesn't have count as deleted.
+    Returns whether all of them are gone.
+    """
+    commands = [(f'DELETE {filename}\n', None) for filename in filenames]
+    try:
+        responses = request(node, lambda conn: _pipeline(conn, commands, NodeConnection.readline, depth))
+    except Exception as e:
+        print(f'Failed to delete {len(filenames)} blocks on {node["name"]}: {str(e)}')
+        return False
+    failed = [filename for filename, response in zip(filenames, responses)
+              if response not in ('OK', 'ERROR File not found')]
+    if failed:
+        print(f'Error deleting {len(failed)} blocks on {node["name"]}: {failed[:8]}')
+    return not failed
+
+# Object names are percent-encoded on the wire so they stay one protocol token.
+
+def put_metadata(node, name, data):
+    try:
+        response = send_command(node['host'], node['port'], f'PUTMETA {quote(name, safe="")} {len(data)}\n', data)
+        if response != 'OK':
+            print(f'Error storing metadata of {name} on {node["name"]}: {response}')
+            return False
+        return True
+    except Exception as e:
+        print(f'Failed to store metadata of {name} on {node["name"]}: {str(e)}')
+        return False
+
+def get_metadata(node, name, missing_ok=False):
+    """
+    Return the metadata blob of object name, or None if the node doesn't have
+    it; with missing_ok, an object the node doesn't know isn't reported.
+    """
+    command = f'GETMETA {quote(name, safe="")}\n'
+
+    def exchange(conn):
+        conn.send(command)
+        return _read_retrieve_response(conn)
+
+    try:
+        response, data = request(node, exchange)
+        if data is None and not (missing_ok and response == 'ERROR Object not found'):
+            print(f'Error retrieving metadata of {name} from {node["name"]}: {response}')
+        return data
+    except Exception as e:
+        print(f'Failed to retrieve metadata of {name} from {node["name"]}: {str(e)}')
+        return None
+
+def list_metadata(node, start_after='', limit=LIST_PAGE_SIZE):
+    """
+    Return the names of up to limit objects on node that sort after
+    start_after, or None if the node can't list them. Names are ordered by
+    their percent-encoded form, so '[' (%5B) comes before 'Z'. Fewer than
+    limit names means the listing is complete.
+    """
+    command = f'LISTMETA {limit} {quote(start_after, safe="")}\n'
+
+    def exchange(conn):
+        conn.send(command)
+        response = conn.readline()
+        if not response.startswith('OK'):
+            return response, None
+        return response, [unquote(conn.readline()) for _ in range(int(response.split()[1]))]
+
+    try:
+        response, names = request(node, exchange)
+        if names is None:
+            print(f'Error listing objects on {node["name"]}: {response}')
+        return names
+    except Exception as e:
+        print(f'Failed to list objects on {node["name"]}: {str(e)}')
+        return None
+
+def delete_metadata(node, name):
+    """
+    Remove object name from node's metadata; an object the node doesn't know
+    counts as removed.
+    """
+    try:
+        response = send_command(node['host'], node['port'], f'DELMETA {quote(name, safe="")}\n')
+        if response not in ('OK', 'ERROR Object not found'):
+            print(f'Error deleting metadata of {name} on {node["name"]}: {response}')
+            return False
+        return True
+    except Exception as e:
+        print(f'Failed to delete metadata of {name} on {node["name"]}: {str(e)}')
+        return False
+
+def start_scrub(node):
+    """
+    Have node check all its blocks against their checksums in the background.
+    """
+    try:
+        return send_command(node['host'], node['port'], 'SCRUB\n') == 'OK'
+    except Exception as e:
+        print(f'Failed to start a scrub on {node["name"]}: {str(e)}')
+        return False
+
+def scrub_status(node):
+    """
+    Return {'running', 'checked', 'total', 'corrupt'} for node's scrub, where
+    corrupt lists the blocks known not to match their checksum, or None.
+    """
+    def exchange(conn):
+        conn.send('SCRUBSTATUS\n')
+        response = conn.readline()
+        if not response.startswith('OK'):
+            raise ValueError(response)
+        running, checked, total, count = map(int, response.split()[1:])
+        return {'running': bool(running), 'checked': checked, 'total': total,
+                'corrupt': [conn.readline() for _ in range(count)]}
+
+    try:
+        return request(node, exchange)
+    except Exception as e:
+        print(f'Failed to get the scrub status of {node["name"]}: {str(e)}')
+        return None
+
+
+class StripeIO:
+    """
+    Issue a stripe's per-node block operations concurrently.
+
+    Every node gets its own pooled connection per operation, so a stripe costs
+    the slowest node's round trip instead of the sum over all nodes. The pool is
+    sized for `depth` outstanding stripes; callers keep at most that many
+    submitted but not yet collected so each node sees up to `depth` requests.
+    One more thread per node is left for hedged reads. block_size, the size of
+    the blocks read, is needed to time reads by their size for hedging.
+    """
+
+    def __init__(self, nodes, depth=NODE_IO_DEPTH, block_size=None):
+        self.nodes = nodes
+        self.depth = depth
+        self.block_size = block_size
+        self._executor = ThreadPoolExecutor(max_workers=len(nodes) * (depth + 1))
+
+    def submit_store(self, items):
+        """
+        items holds one (filename, data) pair per node, or None to skip a node.
+        Returns one future per node (None where skipped) resolving to store_block's result.
+        """
+        return [self._executor.submit(store_block, node, *item) if item is not None else None
+                for node, item in zip(self.nodes, items)]
+
+    def submit_each(self, func, *args):
+        """
+        Run func(node, *args) for every node; returns one future per node.
+        """
+        return [self._executor.submit(func, node, *args) for node in self.nodes]
+
+    def submit_store_batch(self, items):
+        """
+        items holds a list of (filename, data) pairs per node, or None to skip a node.
+        Each node's list goes out as MSTORE requests; returns one future per node
+        (None where skipped) resolving to store_blocks_batch's result.
+        """
+        return [self._executor.submit(store_blocks_batch, node, node_items) if node_items is not None else None
+                for node, node_items in zip(self.nodes, items)]
+
+    def submit_retrieve_batch(self, filenames):
+        """
+        filenames holds a list of names per node, or None to skip a node.
+        Each node's list goes out as MRETRIEVE requests; returns one future per
+        node (None where skipped) resolving to retrieve_blocks_batch's result.
+        Their latencies feed read_latency if the block size is known.
+        """
+        started = time.monotonic()
+
+        def recorder(node, names):
+            def record(future):
+                if not future.cancelled():
+                    read_latency.record(node, len(names) * self.block_size, time.monotonic() - started)
+            return record
+
+        futures = [self._executor.submit(retrieve_blocks_batch, node, names) if names is not None else None
+                   for node, names in zip(self.nodes, filenames)]
+        for node, names, future in zip(self.nodes, filenames, futures):
+            if future is not None and self.block_size:
+                future.add_done_callback(recorder(node, names))
+        return futures
+
+    def submit_delete_batch(self, filenames):
+        """
+        filenames holds a list of names per node, or None to skip a node.
+        Returns one future per node (None where skipped) resolving to
+        delete_blocks' result.
+        """
+        return [self._executor.submit(delete_blocks, node, names) if names is not None else None
+                for node, names in zip(self.nodes, filenames)]
+
+    def hedge_deadline(self, blocks):
+        """
+        Seconds after which a read of `blocks` blocks from one node should be
+        hedged, or None if it shouldn't be.
+        """
+        return hedge_deadline(blocks * self.block_size) if self.block_size else None
+
+    def close(self):
+        # Reads that lost a hedge may still be running; let them finish unused
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -14,82 +14,721 @@
 
 # storage_node_server.py
 
-import socket
-import threading
+import asyncio
 import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 STORAGE_DIR = 'storage'
+LISTEN_BACKLOG = 1024           # pending connections the kernel queues for accept()
+MAX_CONCURRENT_REQUESTS = 64    # commands being served at once across all connections
+DISK_IO_WORKERS = 8             # threads doing blocking file I/O
+CHUNK_SIZE = 256 * 1024         # payload bytes moved per disk read/write
+STREAM_LIMIT = 64 * 1024        # longest header line accepted
+SEGMENT_MAX_BYTES = 1024 ** 3   # a segment file is closed to appends past this size
+SCRUB_RATE = 100 * 1024 ** 2    # bytes/s read by a background scrub, 0 for no limit
+COMPACT_INTERVAL = 60           # seconds between looks for segments worth compacting
+COMPACT_DEAD_RATIO = 0.5        # share of a sealed segment that must be dead before it is compacted
+COMPACT_RATE = 100 * 1024 ** 2  # bytes/s copied by compaction, 0 for no limit
+DROP_WAIT = 60                  # seconds a compacted segment waits for blocks being sent from it
 
-def recv_until_newline(conn):
-    data = b''
-    while True:
-        chunk = conn.recv(1)
-        if not chunk or chunk == b'\n':
-            break
-        data += chunk
-    return data.decode('utf-8').strip()
+INDEX_FILE = 'index'
+METADATA_DB = 'metadata.db'
+SEGMENT_FILE = 'segment_{:06d}'
+# Index log record: op, segment, offset, size, name length, followed by the
+# name and, for _PUT_CHECKED, the CRC-32 of the block
+_RECORD = struct.Struct('<BIQQH')
+_CRC = struct.Struct('<I')
+_PUT = 1
+_PUT_CHECKED = 2
+_DELETE = 0
 
-def handle_client(conn, addr):
-    try:
-        while True:
-            command = recv_until_newline(conn)
-            if not command:
+
+class ExtentStore:
+    """
+    Blocks packed back to back into append-only segment files.
+
+    Each block is an extent (segment, offset, size, crc) in an in-memory
+    index. The index is persisted as an append-only log of compact records that
+    is replayed and rewritten without dead records at startup. An extent
+    becomes visible only after its data is written and its record is appended,
+    so readers never see a partial block. Overwritten and deleted blocks leave
+    dead space behind; compaction copies the live extents of a sealed segment
+    to the end of the current one and removes the segment once no block is
+    being sent from it. Each segment file is opened once and shared, with
+    positional reads and writes. crc is the CRC-32 of the block as it was
+    received, or None for blocks stored before checksums were kept; blocks
+    found not to match it are listed in `corrupt` until they are replaced.
+    """
+
+    def __init__(self, directory, segment_max=SEGMENT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_max = segment_max
+        self.extents = {}
+        self.corrupt = set()
+        self._lock = threading.Lock()
+        self._unpinned = threading.Condition(self._lock)
+        self._files = {}
+        self._readers = {}
+        segments = self._existing_segments()
+        self._load_index(segments)
+        self._segment = max(segments, default=0)
+        self._tail = segments.get(self._segment, 0)
+        self._index = open(os.path.join(directory, INDEX_FILE), 'ab')
+        # Bytes allocated in and still referenced from each segment, and
+        # allocations whose extent is still being written
+        self._sizes = dict(segments)
+        self._live = {}
+        self._writers = {}
+        for segment, _, size, _ in self.extents.values():
+            self._live[segment] = self._live.get(segment, 0) + size
+
+    def _existing_segments(self):
+        sizes = {}
+        for name in os.listdir(self.directory):
+            segment = _segment_number(name)
+            if segment is not None:
+                sizes[segment] = os.path.getsize(os.path.join(self.directory, name))
+        return sizes
+
+    def _load_index(self, segment_sizes):
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        position = 0
+        # A torn record at the end of the log is from an unacknowledged store
+        while position + _RECORD.size <= len(data):
+            op, segment, offset, size, name_length = _RECORD.unpack_from(data, position)
+            name_end = position + _RECORD.size + name_length
+            end = name_end + _CRC.size if op == _PUT_CHECKED else name_end
+            if end > len(data):
                 break
-            if command.startswith('STORE'):
-                _, filename, filesize = command.split()
-                filesize = int(filesize)
-                data = b''
-                while len(data) < filesize:
-                    packet = conn.recv(min(4096, filesize - len(data)))
-                    if not packet:
-                        break
-                    data += packet
-                if not os.path.exists(STORAGE_DIR):
-                    os.makedirs(STORAGE_DIR)
-                with open(os.path.join(STORAGE_DIR, filename), 'wb') as f:
-                    f.write(data)
-                conn.sendall(b'OK\n')
-            elif command.startswith('RETRIEVE'):
-                _, filename = command.split()
-                filepath = os.path.join(STORAGE_DIR, filename)
-                if os.path.exists(filepath):
-                    with open(filepath, 'rb') as f:
-                        data = f.read()
-                    conn.sendall(f'OK {len(data)}\n'.encode('utf-8'))
-                    conn.sendall(data)
-                else:
-                    conn.sendall(b'ERROR File not found\n')
-            elif command.startswith('DELETE'):
-                _, filename = command.split()
-                filepath = os.path.join(STORAGE_DIR, filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    conn.sendall(b'OK\n')
-                else:
-                    conn.sendall(b'ERROR File not found\n')
-            elif command.startswith('PING'):
-                # Respond to PING with PONG
-                conn.sendall(b'PONG\n')
+            name = data[position + _RECORD.size:name_end].decode('utf-8')
+            crc = _CRC.unpack_from(data, name_end)[0] if op == _PUT_CHECKED else None
+            position = end
+            if op != _DELETE and offset + size <= segment_sizes.get(segment, 0):
+                self.extents[name] = (segment, offset, size, crc)
             else:
-                conn.sendall(b'ERROR Unknown command\n')
-    finally:
-        conn.close()
-
-def start_server(port):
-    if not os.path.exists(STORAGE_DIR):
-        os.makedirs(STORAGE_DIR)
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind(('', port))
-    server_socket.listen(5)
-    print(f'Storage node server started on port {port}')
+                self.extents.pop(name, None)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            for name, extent in self.extents.items():
+                f.write(_record(_PUT, name, *extent))
+        os.replace(tmp_path, path)
+
+    def sync(self):
+        """
+        Flush the index and every open segment file to disk.
+        """
+        with self._lock:
+            files = list(self._files.values())
+            self._index.flush()
+            os.fsync(self._index.fileno())
+        for file in files:
+            os.fsync(file.fileno())
+
+    def _path(self, segment):
+        return os.path.join(self.directory, SEGMENT_FILE.format(segment))
+
+    def segment_file(self, segment, create=False):
+        """
+        Return the unbuffered file of segment, opening it on first use.
+        """
+        with self._lock:
+            file = self._files.get(segment)
+            if file is None:
+                flags = os.O_RDWR | os.O_CREAT if create else os.O_RDWR
+                file = self._files[segment] = open(os.open(self._path(segment), flags, 0o644), 'r+b', buffering=0)
+            return file
+
+    def _account(self, old, new):
+        # Move the live byte count from the extent a name had to its new one
+        if old is not None:
+            self._live[old[0]] -= old[2]
+        if new is not None:
+            self._live[new[0]] = self._live.get(new[0], 0) + new[2]
+
+    def allocate(self, size):
+        """
+        Reserve size bytes at the end of the current segment. The caller must
+        release() the segment once the extent is committed or abandoned.
+        """
+        with self._lock:
+            if self._tail and self._tail + size > self.segment_max:
+                self._segment += 1
+                self._tail = 0
+            offset = self._tail
+            self._tail += size
+            self._sizes[self._segment] = self._tail
+            self._writers[self._segment] = self._writers.get(self._segment, 0) + 1
+            return self._segment, offset
+
+    def release(self, segment):
+        with self._lock:
+            self._writers[segment] -= 1
+
+    def write_at(self, segment, offset, data, crc=0):
+        """
+        Write data at offset and return its CRC-32 continued from crc.
+        """
+        fd = self.segment_file(segment, create=True).fileno()
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view = view[n:]
+            offset += n
+        return zlib.crc32(data, crc)
+
+    def commit(self, name, segment, offset, size, crc):
+        """
+        Publish a fully written extent under name.
+        """
+        extent = (segment, offset, size, crc)
+        with self._lock:
+            self._index.write(_record(_PUT, name, *extent))
+            self._index.flush()
+            self._account(self.extents.get(name), extent)
+            self.extents[name] = extent
+            self.corrupt.discard(name)
+
+    def put(self, name, data, expected_crc=None):
+        """
+        Store a block; if expected_crc is given and the data doesn't match it,
+        nothing is published and False is returned.
+        """
+        crc = zlib.crc32(data)
+        if expected_crc is not None and crc != expected_crc:
+            return False
+        segment, offset = self.allocate(len(data))
+        try:
+            self.write_at(segment, offset, data)
+            self.commit(name, segment, offset, len(data), crc)
+        finally:
+            self.release(segment)
+        return True
+
+    def pin(self, name):
+        """
+        Return (extent, file) for name, or (None, None), and keep the segment
+        from being removed until unpin(). file is None if the segment isn't
+        open yet; segment_file() opens it.
+        """
+        with self._lock:
+            extent = self.extents.get(name)
+            if extent is None:
+                return None, None
+            self._readers[extent[0]] = self._readers.get(extent[0], 0) + 1
+            return extent, self._files.get(extent[0])
+
+    def unpin(self, segment):
+        with self._lock:
+            self._readers[segment] -= 1
+            if not self._readers[segment]:
+                del self._readers[segment]
+                self._unpinned.notify_all()
+
+    def read_at(self, segment, offset, size):
+        fd = self.segment_file(segment).fileno()
+        chunks = []
+        while size:
+            chunk = os.pread(fd, size, offset)
+            if not chunk:
+                raise ConnectionError('extent truncated')
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    def verify(self, name, extent):
+        """
+        Re-read extent from disk in CHUNK_SIZE pieces and check it against its
+        CRC. A mismatch marks name corrupt unless it has since been replaced.
+        Returns the result, or None for a block without a checksum.
+        """
+        segment, offset, size, crc = extent
+        if crc is None:
+            return None
+        actual = 0
+        end = offset + size
+        try:
+            while offset < end:
+                chunk = self.read_at(segment, offset, min(CHUNK_SIZE, end - offset))
+                actual = zlib.crc32(chunk, actual)
+                offset += len(chunk)
+        except (OSError, ConnectionError):
+            actual = None
+        if actual == crc:
+            return True
+        with self._lock:
+            if self.extents.get(name) == extent:
+                self.corrupt.add(name)
+        return False
+
+    def delete(self, name):
+        with self._lock:
+            if name not in self.extents:
+                return False
+            self._index.write(_record(_DELETE, name, 0, 0, 0))
+            self._index.flush()
+            self._account(self.extents.pop(name), None)
+            self.corrupt.discard(name)
+            return True
+
+    def compactable(self, dead_ratio):
+        """
+        Sealed segments of which at least dead_ratio is dead space, deadest first.
+        """
+        with self._lock:
+            dead = {segment: size - self._live.get(segment, 0) for segment, size in self._sizes.items()
+                    if segment != self._segment and size - self._live.get(segment, 0) >= dead_ratio * size}
+        return sorted(dead, key=dead.get, reverse=True)
+
+    def segment_extents(self, segment):
+        with self._lock:
+            return [(name, extent) for name, extent in self.extents.items() if extent[0] == segment]
+
+    def move(self, name, extent):
+        """
+        Copy a live extent to the end of the current segment and point name at
+        the copy, unless name was replaced or deleted in the meantime. The CRC
+        is carried over, and a copy that doesn't match it stays corrupt.
+        """
+        segment, offset, size, crc = extent
+        data = self.read_at(segment, offset, size)
+        new_segment, new_offset = self.allocate(size)
+        try:
+            actual = self.write_at(new_segment, new_offset, data)
+            moved = (new_segment, new_offset, size, crc)
+            with self._lock:
+                if self.extents.get(name) != extent:
+                    return
+                self._index.write(_record(_PUT, name, *moved))
+                self._index.flush()
+                self._account(extent, moved)
+                self.extents[name] = moved
+                if crc is not None and actual != crc:
+                    self.corrupt.add(name)
+        finally:
+            self.release(new_segment)
+
+    def drop_segment(self, segment, timeout=DROP_WAIT):
+        """
+        Remove a sealed segment nothing refers to or writes to any more, once
+        the copies of its extents and their index records are on disk and the
+        blocks still being sent from it are done, waiting up to timeout
+        seconds for them. Returns whether it was removed.
+        """
+        self.sync()
+        with self._lock:
+            if segment == self._segment or self._live.get(segment) or self._writers.get(segment):
+                return False
+            if not self._unpinned.wait_for(lambda: segment not in self._readers, timeout):
+                return False
+            file = self._files.pop(segment, None)
+            if file is not None:
+                file.close()
+            os.remove(self._path(segment))
+            self._sizes.pop(segment, None)
+            self._live.pop(segment, None)
+            self._writers.pop(segment, None)
+            return True
+
+    def close(self):
+        with self._lock:
+            self._index.close()
+            for file in self._files.values():
+                file.close()
+            self._files.clear()
+
+
+class MetadataIndex:
+    """
+    Object metadata in an SQLite table keyed by object name, so a lookup is a
+    B-tree search and listing walks the names in order.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, METADATA_DB), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS objects '
+                         '(name TEXT PRIMARY KEY, metadata BLOB NOT NULL) WITHOUT ROWID')
+
+    def put(self, name, metadata):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO objects (name, metadata) VALUES (?, ?)', (name, metadata))
+
+    def get(self, name):
+        with self._lock:
+            row = self._db.execute('SELECT metadata FROM objects WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def list(self, limit, start_after=''):
+        with self._lock:
+            rows = self._db.execute('SELECT name FROM objects WHERE name > ? ORDER BY name LIMIT ?',
+                                    (start_after, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, name):
+        with self._lock, self._db:
+            return self._db.execute('DELETE FROM objects WHERE name = ?', (name,)).rowcount > 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _segment_number(filename):
+    prefix = SEGMENT_FILE.split('{')[0]
+    if filename.startswith(prefix) and filename[len(prefix):].isdigit():
+        return int(filename[len(prefix):])
+    return None
+
+
+def _in_page_cache(file, offset, size):
+    """
+    Whether the first and last byte of a range of file can be read without
+    waiting for the disk. Without non-blocking reads (RWF_NOWAIT, Linux) the
+    range counts as not cached.
+    """
+    if not hasattr(os, 'RWF_NOWAIT'):
+        return False
+    probe = bytearray(1)
     try:
+        return all(os.preadv(file.fileno(), [probe], position, os.RWF_NOWAIT) == 1
+                   for position in (offset, offset + size - 1))
+    except OSError:
+        return False
+
+
+def _record(op, name, segment, offset, size, crc=None):
+    name = name.encode('utf-8')
+    if crc is None:
+        return _RECORD.pack(op, segment, offset, size, len(name)) + name
+    return _RECORD.pack(_PUT_CHECKED, segment, offset, size, len(name)) + name + _CRC.pack(crc)
+
+
+async def _read_header(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError('connection closed mid-batch')
+    return line.decode('utf-8').strip()
+
+
+class StorageNode:
+    """
+    Serve STORE/RETRIEVE/DELETE/PING, the batched MSTORE/MRETRIEVE, the
+    object metadata commands PUTMETA/GETMETA/LISTMETA/DELMETA and the
+    checksum scrub commands SCRUB/SCRUBSTATUS on an asyncio event loop.
+
+    Every connection is a coroutine, but at most max_concurrent commands are
+    served at a time: a connection whose command is waiting for a slot stops
+    reading, so the client is held back by TCP flow control instead of the
+    node queueing its payload. Blocks live in an ExtentStore and object
+    metadata in a MetadataIndex; their blocking I/O runs on a bounded thread pool.
+    Segments left mostly dead by overwrites and deletes are compacted in the
+    background.
+    """
+
+    def __init__(self, storage_dir=STORAGE_DIR, max_concurrent=MAX_CONCURRENT_REQUESTS,
+                 io_workers=DISK_IO_WORKERS):
+        self.store = ExtentStore(storage_dir)
+        self.metadata = MetadataIndex(storage_dir)
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._executor = ThreadPoolExecutor(max_workers=io_workers)
+        self._scrub = None
+        self.scrub_checked = 0
+        self.scrub_total = 0
+
+    async def _run_io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.store.close()
+        self.metadata.close()
+
+    async def receive_block(self, reader, filename, filesize, expected_crc=None):
+        """
+        Stream an upload into a freshly allocated extent and publish it once
+        complete. Small blocks are received whole and stored in one I/O call.
+        The CRC-32 of the payload is kept with the block; if the client sent
+        one and it doesn't match, the block is dropped and False is returned.
+        """
+        if filesize <= CHUNK_SIZE:
+            data = await reader.readexactly(filesize)
+            return await self._run_io(self.store.put, filename, data, expected_crc)
+        segment, offset = self.store.allocate(filesize)
+        try:
+            position = offset
+            remaining = filesize
+            crc = 0
+            while remaining:
+                chunk = await reader.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise ConnectionError('connection closed mid-payload')
+                crc = await self._run_io(self.store.write_at, segment, position, chunk, crc)
+                position += len(chunk)
+                remaining -= len(chunk)
+            if expected_crc is not None and crc != expected_crc:
+                return False
+            await self._run_io(self.store.commit, filename, segment, offset, filesize, crc)
+            return True
+        finally:
+            self.store.release(segment)
+
+    async def send_block(self, writer, filename):
+        """
+        Answer with OK <size> [<crc>] and the block. A block in the page cache
+        is sent with sendfile() straight from its offset in the segment file;
+        any other is read on the disk I/O threads, so a cold read doesn't hold
+        up the event loop. It is the client that checks the block against the
+        CRC; blocks a scrub found corrupt are refused.
+        """
+        extent, segment_file = self.store.pin(filename)
+        if extent is None:
+            writer.write(b'ERROR File not found\n')
+            return
+        segment, offset, size, crc = extent
+        try:
+            if filename in self.store.corrupt:
+                writer.write(b'ERROR Checksum mismatch\n')
+                return
+            if segment_file is None:
+                segment_file = await self._run_io(self.store.segment_file, segment)
+            writer.write((f'OK {size}\n' if crc is None else f'OK {size} {crc}\n').encode('utf-8'))
+            if not size:
+                return
+            if _in_page_cache(segment_file, offset, size):
+                sent = await asyncio.get_running_loop().sendfile(writer.transport, segment_file, offset, size)
+                if sent < size:
+                    raise ConnectionError('extent truncated while being sent')
+                return
+            writer.write(await self._run_io(self.store.read_at, segment, offset, size))
+        finally:
+            self.store.unpin(segment)
+
+    async def delete_block(self, writer, filename):
+        if await self._run_io(self.store.delete, filename):
+            writer.write(b'OK\n')
+        else:
+            writer.write(b'ERROR File not found\n')
+
+    async def store_batch(self, reader, writer, count):
+        """
+        MSTORE <count> is followed by count entries of `<filename> <size> [<crc>]`
+        plus the payload, and answered with a single OK once all of them are
+        stored, or an error naming the blocks that failed their checksum.
+        """
+        mismatched = []
+        for _ in range(count):
+            filename, filesize, *crc = (await _read_header(reader)).split()
+            if not await self.receive_block(reader, filename, int(filesize), int(crc[0]) if crc else None):
+                mismatched.append(filename)
+        if mismatched:
+            writer.write(f'ERROR Checksum mismatch {" ".join(mismatched)}\n'.encode('utf-8'))
+        else:
+            writer.write(b'OK\n')
+
+    async def retrieve_batch(self, reader, writer, count):
+        """
+        MRETRIEVE <count> is followed by count filename lines; each block is
+        answered in order exactly as RETRIEVE would answer it.
+        """
+        filenames = [await _read_header(reader) for _ in range(count)]
+        for filename in filenames:
+            await self.send_block(writer, filename)
+
+    async def scrub(self, rate=SCRUB_RATE):
+        """
+        Check every block that has a checksum against its data on disk, at most
+        rate bytes per second, sharing the disk I/O threads with requests.
+        """
+        extents = list(self.store.extents.items())
+        self.scrub_checked, self.scrub_total = 0, len(extents)
+        started = time.monotonic()
+        scanned = 0
+        for name, extent in extents:
+            await self._run_io(self.store.verify, name, extent)
+            self.scrub_checked += 1
+            scanned += extent[2]
+            if rate:
+                delay = started + scanned / rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    def start_scrub(self, writer):
+        """
+        SCRUB starts a background scrub unless one is already running.
+        """
+        if self._scrub is None or self._scrub.done():
+            self._scrub = asyncio.ensure_future(self.scrub())
+        writer.write(b'OK\n')
+
+    def scrub_status(self, writer):
+        """
+        SCRUBSTATUS answers with OK <running> <checked> <total> <count>,
+        followed by the names of the count blocks known to be corrupt.
+        """
+        running = int(self._scrub is not None and not self._scrub.done())
+        corrupt = sorted(self.store.corrupt)
+        writer.write(f'OK {running} {self.scrub_checked} {self.scrub_total} {len(corrupt)}\n'.encode('utf-8') +
+                     ''.join(f'{name}\n' for name in corrupt).encode('utf-8'))
+
+    async def compact(self, dead_ratio=COMPACT_DEAD_RATIO, rate=COMPACT_RATE):
+        """
+        Copy the live blocks out of every sealed segment that is at least
+        dead_ratio dead space and remove the segment, copying at most rate
+        bytes per second on the disk I/O threads. Returns the segments removed.
+        """
+        removed = []
+        started = time.monotonic()
+        copied = 0
+        for segment in self.store.compactable(dead_ratio):
+            try:
+                for name, extent in self.store.segment_extents(segment):
+                    await self._run_io(self.store.move, name, extent)
+                    copied += extent[2]
+                    if rate:
+                        delay = started + copied / rate - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                if await self._run_io(self.store.drop_segment, segment):
+                    removed.append(segment)
+            except (OSError, ConnectionError) as e:
+                print(f'Could not compact segment {segment}: {e}')
+        if removed:
+            print(f'Compacted segments {removed}')
+        return removed
+
+    async def compact_forever(self, interval=COMPACT_INTERVAL):
         while True:
-            conn, addr = server_socket.accept()
-            threading.Thread(target=handle_client, args=(conn, addr)).start()
-    finally:
-        server_socket.close()
+            await self.compact()
+            await asyncio.sleep(interval)
+
+    async def put_metadata(self, reader, writer, name, size):
+        data = await reader.readexactly(size)
+        await self._run_io(self.metadata.put, name, data)
+        writer.write(b'OK\n')
+
+    async def send_metadata(self, writer, name):
+        data = await self._run_io(self.metadata.get, name)
+        if data is None:
+            writer.write(b'ERROR Object not found\n')
+            return
+        writer.write(f'OK {len(data)}\n'.encode('utf-8'))
+        writer.write(data)
+
+    async def list_metadata(self, writer, limit, start_after):
+        """
+        LISTMETA <limit> [<start_after>] answers with OK <count> and one object
+        name per line, ordered by the names as sent, that is percent-encoded.
+        """
+        names = await self._run_io(self.metadata.list, limit, start_after)
+        writer.write(f'OK {len(names)}\n'.encode('utf-8') + ''.join(f'{name}\n' for name in names).encode('utf-8'))
+
+    async def delete_metadata(self, writer, name):
+        if await self._run_io(self.metadata.delete, name):
+            writer.write(b'OK\n')
+        else:
+            writer.write(b'ERROR Object not found\n')
+
+    async def handle_command(self, command, reader, writer):
+        if command.startswith('PUTMETA'):
+            _, name, size = command.split()
+            await self.put_metadata(reader, writer, name, int(size))
+        elif command.startswith('GETMETA'):
+            _, name = command.split()
+            await self.send_metadata(writer, name)
+        elif command.startswith('LISTMETA'):
+            _, limit, *start_after = command.split()
+            await self.list_metadata(writer, int(limit), start_after[0] if start_after else '')
+        elif command.startswith('DELMETA'):
+            _, name = command.split()
+            await self.delete_metadata(writer, name)
+        elif command.startswith('MSTORE'):
+            _, count = command.split()
+            await self.store_batch(reader, writer, int(count))
+        elif command.startswith('MRETRIEVE'):
+            _, count = command.split()
+            await self.retrieve_batch(reader, writer, int(count))
+        elif command.startswith('SCRUBSTATUS'):
+            self.scrub_status(writer)
+        elif command.startswith('SCRUB'):
+            self.start_scrub(writer)
+        elif command.startswith('STORE'):
+            _, filename, filesize, *crc = command.split()
+            if await self.receive_block(reader, filename, int(filesize), int(crc[0]) if crc else None):
+                writer.write(b'OK\n')
+            else:
+                writer.write(b'ERROR Checksum mismatch\n')
+        elif command.startswith('RETRIEVE'):
+            _, filename = command.split()
+            await self.send_block(writer, filename)
+        elif command.startswith('DELETE'):
+            _, filename = command.split()
+            await self.delete_block(writer, filename)
+        elif command.startswith('PING'):
+            # Respond to PING with PONG
+            writer.write(b'PONG\n')
+        else:
+            writer.write(b'ERROR Unknown command\n')
+
+    async def handle_client(self, reader, writer):
+        # asyncio enables TCP_NODELAY on its TCP transports, so replies are not
+        # held back by Nagle between the header and the payload.
+        addr = writer.get_extra_info('peername')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8').strip()
+                async with self._slots:
+                    await self.handle_command(command, reader, writer)
+                    await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+            print(f'Closing connection from {addr}: {e}')
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, port, backlog=LISTEN_BACKLOG):
+        server = await asyncio.start_server(self.handle_client, port=port, backlog=backlog,
+                                            limit=STREAM_LIMIT)
+        print(f'Storage node server started on port {port}')
+        compactor = asyncio.ensure_future(self.compact_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            compactor.cancel()
+
+
+def start_server(port, max_concurrent=MAX_CONCURRENT_REQUESTS, io_workers=DISK_IO_WORKERS,
+                 backlog=LISTEN_BACKLOG):
+    async def run():
+        node = StorageNode(max_concurrent=max_concurrent, io_workers=io_workers)
+        try:
+            await node.serve(port, backlog)
+        finally:
+            node.close()
+
+    asyncio.run(run())
 
 if __name__ == '__main__':
     import sys
     port = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
-    start_server(port)
\ No newline at end of file
+    max_concurrent = int(sys.argv[2]) if len(sys.argv) > 2 else MAX_CONCURRENT_REQUESTS
+    start_server(port, max_concurrent=max_concurrent)
\ No newline at end of file
@@ -23,8 +23,76 @@ def read_file_to_blocks(file_path, block_size):
         blocks[-1] += b'\x00' * (block_size - len(blocks[-1]))
     return blocks, len(data)
 
+def iter_file_stripes(file_path, block_size, data_disks, depth=2):
+    """
+    Stream a file as ready-to-encode stripes of data_disks blocks each.
+
+    Each stripe is read with readinto() into one of `depth` reusable buffers and
+    yielded as a list of memoryview blocks, so a yielded stripe is only valid until
+    `depth` further stripes have been pulled. The tail stripe is zero-padded.
+    Peak memory is depth * block_size * data_disks regardless of file size.
+    """
+    stripe_size = block_size * data_disks
+    buffers = [bytearray(stripe_size) for _ in range(max(1, depth))]
+    with open(file_path, 'rb', buffering=0) as f:
+        stripe_index = 0
+        while True:
+            view = memoryview(buffers[stripe_index % len(buffers)])
+            filled = 0
+            while filled < stripe_size:
+                n = f.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+            if filled == 0:
+                return
+            if filled < stripe_size:
+                view[filled:] = bytes(stripe_size - filled)
+            yield [view[i:i + block_size] for i in range(0, stripe_size, block_size)]
+            stripe_index += 1
+            if filled < stripe_size:
+                return
+
 def write_blocks_to_file(blocks, file_path, original_size):
     with open(file_path, 'wb') as f:
         for block in blocks:
             f.write(block)
-        f.truncate(original_size)  # Ensure we don't write extra padding
\ No newline at end of file
+        f.truncate(original_size)  # Ensure we don't write extra padding
+
+
+def open_output_file(file_path, size=0, preallocate=True):
+    """
+    Open file_path for positional stripe writes, reserving `size` bytes up front
+    with posix_fallocate where the platform and filesystem support it.
+    """
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    if preallocate and size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass  # e.g. filesystems without fallocate support; writes still work
+    return fd
+
+def write_stripe_at(fd, blocks, offset):
+    """
+    Write a stripe's blocks at `offset` with a single pwritev where available.
+    Returns the offset just past the written data.
+    """
+    total = sum(len(block) for block in blocks)
+    written = os.pwritev(fd, blocks, offset) if hasattr(os, 'pwritev') else 0
+    if written < total:
+        remaining = memoryview(b''.join(blocks))[written:]
+        position = offset + written
+        while remaining:
+            if hasattr(os, 'pwrite'):
+                n = os.pwrite(fd, remaining, position)
+            else:
+                os.lseek(fd, position, os.SEEK_SET)
+                n = os.write(fd, remaining)
+            remaining = remaining[n:]
+            position += n
+    return offset + total
+
+def close_output_file(fd, original_size):
+    os.ftruncate(fd, original_size)  # Drop the tail stripe's padding
+    os.close(fd)